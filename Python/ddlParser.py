@@ -0,0 +1,142 @@
+#!/opt/local/bin/python
+# -*- coding: UTF-8 -*-
+#
+# ddlParser - entries of a Basis DDL (DMDDBE), shared by ddlViewer and hvuConvert,
+# and the record schema compiled from the ADM RECORD= / FIELD= entries
+# created : marcel.bechtiger@domain-sa.ch - 20261018
+# modified :
+# usage : import ddlParser
+#         ddlItems = ddlParser.buildDdlItems(ddlParser.loadDdlLines("tour.ddl"))
+#         schema = ddlParser.compileDdlSchema(ddlItems)
+#
+
+import re
+
+encoding = "ISO-8859-1"
+# quoted strings of an entry (labels, prompts...), '' is a quote inside
+quotedRe = re.compile(r"'(?:[^']|'')*'")
+# entries ending the record context (FIELD= also appears in views)
+recordEndEntries = ("VIEW", "USER_DATA_MODEL", "MODEL", "STRUCTURAL_DATA_MODEL")
+
+def loadDdlLines(ddlFileName, ddlEncoding=encoding):
+    '''
+    read all ddl lines, IOError left to the caller
+    '''
+    with open(ddlFileName, 'r', encoding=ddlEncoding) as f:
+        ddlLines = f.read().splitlines()
+    return ddlLines
+
+def buildDdlItems(ddlLines):
+    '''
+    concatenate ddl lines to form ddl entry - ";" terminated
+    handle revl exception where revl contains paragraphs and
+    lines are not always ";" terminated
+    '''
+    ddlItems = []
+    ddlItem = ""
+    inRevl = False
+    for l in ddlLines:
+        #print("<<" + l)
+        l = l.lstrip(" ")
+        # ignore comment lines
+        if l.startswith("*"):
+            continue
+        else:
+            # handle inline comments
+            l = l.split("*")[0].strip(" ")
+            # REVL paragraphs contain lines ending in ;
+            if l.upper().startswith("REVL"):
+                inRevl = True
+            elif l.upper().startswith("END_REVL"):
+                inRevl = False
+            # revl contains proper eol that were removed earliers
+            if inRevl:
+                ddlItem += l + "\n"
+            elif not inRevl and l.endswith(";"):
+                ddlItem += l
+                ddlItems.append(ddlItem)
+                #print(">>" + ddlItem)
+                ddlItem = ""
+            else:
+                ddlItem += l
+                #print(">>>>>" + ddlItem)
+    print("buildDdlItems", len(ddlLines), "ddl lines")
+    return ddlItems
+
+def getDdlAttributes(ddlItem):
+    '''
+    (entry, name, {ATTRIBUTE: value}) of a ddl entry, e.g. ("FIELD", "CITY", {"TYPE": "CHAR", ...}),
+    quoted strings are removed, commas inside parentheses do not split
+    '''
+    text = quotedRe.sub("''", ddlItem).rstrip(";").replace(",+", ",")
+    parts = []
+    part = ""
+    depth = 0
+    for c in text:
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(part)
+            part = ""
+            continue
+        part += c
+    parts.append(part)
+    attributes = {}
+    for part in parts:
+        name, sep, value = part.strip(" +").partition("=")
+        attributes[name.strip().upper()] = value.strip()
+    entry, sep, name = parts[0].strip(" +").partition("=")
+    return entry.strip().upper(), name.strip().upper(), attributes
+
+def getDdlType(attributes):
+    '''
+    "int", "float" or "str" of a field from its TYPE= and USAGE=
+    '''
+    fieldType = attributes.get("TYPE", "").upper()
+    usage = attributes.get("USAGE", "").upper().split("(")[0]
+    if usage == "MONEY" or fieldType in ("FLOAT", "REAL", "DOUBLE_PRECISION", "DECIMAL"):
+        return "float"
+    if fieldType in ("EXACT_BINARY", "INTEGER") or usage == "SYSTEM_KEY":
+        return "int"
+    return "str"
+
+def isDdlMulti(attributes):
+    '''
+    True if OCCURS=min:max allows more than one occurrence
+    '''
+    occurs = attributes.get("OCCURS", "").split(":")[-1].strip()
+    if occurs == "":
+        return False
+    if not occurs.isdigit():
+        return True
+    return int(occurs) > 1
+
+def compileDdlSchema(ddlItems):
+    '''
+    {recordName: [(fieldName, type, isMulti), ...]} in ddl order for the RECORD= entries
+    of the actual data model, a field inherits TYPE= / USAGE= / OCCURS= of its DOMAIN=
+    '''
+    domains = {}
+    records = {}
+    fields = None
+    for ddlItem in ddlItems:
+        entry, name, attributes = getDdlAttributes(ddlItem)
+        if entry == "DOMAIN":
+            domains[name] = attributes
+        elif entry == "RECORD":
+            fields = records.setdefault(name, [])
+        elif entry == "FIELD" and fields is not None:
+            fields.append((name, attributes))
+        elif entry in recordEndEntries:
+            fields = None
+    # domains may be declared after the fields using them
+    schema = {}
+    for recordName, fields in records.items():
+        schema[recordName] = []
+        for fieldName, attributes in fields:
+            domain = domains.get(attributes.get("DOMAIN", "").upper(), {})
+            attributes = dict(domain, **attributes)
+            schema[recordName].append((fieldName, getDdlType(attributes), isDdlMulti(attributes)))
+    return schema
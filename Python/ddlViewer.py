@@ -4,11 +4,13 @@
 # ddlViewer - visualize a Basis DDL as a treeList, by default use encoding "ISO-8859-1" (Latin 1)
 # created : marcel.bechtiger@domain-sa.ch - 20230729
 # modified : 20231107
+#            20261018 - ddl entries built by ddlParser.py, shared with hvuConvert.py
 # usage :
 #
 
 import wx
 import os
+import ddlParser
 
 ddlViewerVersion = "DDL Viewer v. 2023-11-07"
 ddlLines = []
@@ -195,40 +197,10 @@ www.domain-sa.ch
 
     def buildDdlItems(self, ddlLines):
         '''
-        concatenate ddl lines to form ddl entry - ";" terminated
-        handle revl exception where revl contains paragraphs and
-        lines are not always ";" terminated
+        concatenate ddl lines to form ddl entry - ";" terminated,
+        shared with hvuConvert.py --ddl in ddlParser.py
         '''
-        ddlItems = []
-        ddlItem = ""
-        inRevl = False
-        for l in ddlLines:
-            #print("<<" + l)
-            l = l.lstrip(" ")
-            # ignore comment lines
-            if l.startswith("*"):
-                continue
-            else:
-                # handle inline comments
-                l = l.split("*")[0].strip(" ")
-                # REVL paragraphs contain lines ending in ;
-                if l.upper().startswith("REVL"):
-                    inRevl = True
-                elif l.upper().startswith("END_REVL"):
-                    inRevl = False
-                # revl contains proper eol that were removed earliers
-                if inRevl:
-                    ddlItem += l + "\n"
-                elif not inRevl and l.endswith(";"):
-                    ddlItem += l
-                    ddlItems.append(ddlItem)
-                    #print(">>" + ddlItem)
-                    ddlItem = ""
-                else:
-                    ddlItem += l
-                    #print(">>>>>" + ddlItem)
-        print("buildDdlItems", len(ddlLines), "ddl lines")
-        return ddlItems
+        return ddlParser.buildDdlItems(ddlLines)
 
     def buildDdlTree(self, ddlItems):
         '''
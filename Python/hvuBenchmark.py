@@ -0,0 +1,126 @@
+#! /opt/local/bin/python
+
+''' hvuBenchmark : time hvuConvert.py actions on synthetic dumps of growing sizes
+usage : python hvuBenchmark.py {--sizes=1,10,100} {--actions=stats,toJson,toXml,toCsv} {--workdir=dir}
+dumps are written by hvuGenerate.py (kept in workdir for the next runs), each action runs
+in its own process, reported are seconds, records/s, MB/s of input and peak RSS
+created : marcel.bechtiger@domain-sa.ch - 20261018
+modified :
+'''
+
+import getopt, sys, os, subprocess, time, json, shlex
+from datetime import datetime
+import hvuGenerate
+
+# hvuConvert.py next to this script
+convertScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hvuConvert.py")
+# extension of the output file of each action, stats writes none
+outExtensions = {"toJson": ".json", "toJsonl": ".jsonl", "toXml": ".xml", "toCsv": ".csv",
+    "toParquet": ".parquet", "toArrow": ".arrow", "profile": ".json"}
+
+def printUsage():
+    print("usage : hvuBenchmark.py {--sizes=1,10,100} {--actions=stats,toJson,toXml,toCsv} {--workdir=.}")
+    print("            {--options=\"--workers=4\"} {--json=results.json} {--repeat=1}")
+    print("          --sizes dump sizes in MB, dumps bench_<size>MB.dmp are generated once in --workdir")
+    print("          --options added to each hvuConvert.py command, --repeat runs, the fastest is kept")
+    print("          --json writes the results to a file")
+
+def getArguments():
+    # get execution arguments
+    argumentList = sys.argv[1:]
+    options = "h"
+    longOptions = ["help", "sizes=", "actions=", "workdir=", "options=", "json=", "repeat="]
+    opts = {"sizes": [1, 10, 100], "actions": ["stats", "toJson", "toXml", "toCsv"], "workDir": ".",
+        "options": "", "json": "", "repeat": 1}
+    try:
+        arguments, values = getopt.getopt(argumentList, options, longOptions)
+        for a, v in arguments:
+            if a in ("-h", "--help"):
+                printUsage()
+                exit(0)
+            elif a == "--sizes":
+                opts["sizes"] = [float(x) for x in v.split(",")]
+            elif a == "--actions":
+                opts["actions"] = v.split(",")
+            elif a == "--workdir":
+                opts["workDir"] = v
+            elif a == "--options":
+                opts["options"] = v
+            elif a == "--json":
+                opts["json"] = v
+            elif a == "--repeat":
+                opts["repeat"] = int(v)
+    except (getopt.error, ValueError) as err:
+        print (str(err))
+        exit(1)
+    return(opts)
+
+def getDump(size, workDir):
+    # dump of about size MB and its count of records, generated if missing
+    dumpFile = os.path.join(workDir, "bench_%gMB.dmp" % size)
+    countFile = dumpFile + ".count"
+    if os.path.exists(dumpFile) and os.path.exists(countFile):
+        with open(countFile, "r") as f:
+            return(dumpFile, int(f.read()))
+    print("generating", dumpFile)
+    recordCount, bytesCount = hvuGenerate.generateDump(dumpFile, opts={"size": size})
+    with open(countFile, "w") as f:
+        f.write(str(recordCount))
+    return(dumpFile, recordCount)
+
+def runAction(dumpFile, action, options):
+    # run hvuConvert.py once, return (seconds, peak RSS in bytes, return code)
+    outFile = dumpFile + ".out" + outExtensions.get(action, "")
+    command = [sys.executable, convertScript, "-i", dumpFile, "-a", action] + shlex.split(options)
+    if action in outExtensions:
+        command += ["-o", outFile]
+    start = time.perf_counter()
+    p = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    # rusage of this child only
+    pid, status, rusage = os.wait4(p.pid, 0)
+    seconds = time.perf_counter() - start
+    p.returncode = os.waitstatus_to_exitcode(status)
+    if os.path.exists(outFile):
+        os.remove(outFile)
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peakRss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return(seconds, peakRss, p.returncode)
+
+def doBenchmark(opts):
+    results = []
+    print("{0:>10} {1:>10} {2:>12} {3:>9} {4:>12} {5:>8} {6:>10}".format("size MB", "action",
+        "records", "seconds", "records/s", "MB/s", "peak MB"))
+    for size in opts["sizes"]:
+        dumpFile, recordCount = getDump(size, opts["workDir"])
+        megaBytes = os.path.getsize(dumpFile) / 1024 / 1024
+        for action in opts["actions"]:
+            runs = [runAction(dumpFile, action, opts["options"]) for i in range(opts["repeat"])]
+            seconds, peakRss, returnCode = min(runs)
+            result = {"dump": dumpFile, "megaBytes": round(megaBytes, 3), "action": action,
+                "options": opts["options"], "records": recordCount, "seconds": round(seconds, 3),
+                "recordsPerSecond": round(recordCount / seconds), "megaBytesPerSecond": round(megaBytes / seconds, 3),
+                "peakRssMegaBytes": round(peakRss / 1024 / 1024, 1), "returnCode": returnCode}
+            results.append(result)
+            print("{0:>10,.1f} {1:>10} {2:>12,} {3:>9.2f} {4:>12,} {5:>8.2f} {6:>10,.1f}{7}".format(megaBytes,
+                action, recordCount, seconds, result["recordsPerSecond"], result["megaBytesPerSecond"],
+                result["peakRssMegaBytes"], "" if returnCode == 0 else "  failed (%d)" % returnCode))
+    if opts["json"] != "":
+        with open(opts["json"], "w") as f:
+            json.dump(results, f, indent=2)
+        print("*** results written to", opts["json"])
+    return(results)
+
+def getDateTimeNow():
+    now = datetime.now()
+    return(now.strftime("%d.%m.%Y %H:%M:%S"))
+
+########## main ##########
+
+def doMain():
+    print("*** started", getDateTimeNow())
+    opts = getArguments()
+    doBenchmark(opts)
+    print("*** normal termination", getDateTimeNow())
+
+if __name__ == "__main__":
+    doMain()
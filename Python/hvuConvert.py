@@ -1,16 +1,67 @@
 #! /opt/local/bin/python
 
 ''' hvuConvert : convert LCS hvu stream formated file to JSON/XML/CSV or provide field stats
-usage : python hvuConvert.py -i file.dmp -o file.out -a toJson|toXml|toCsv|stats|cstats -e UTF-8
+usage : python hvuConvert.py -i file.dmp -o file.out -a toJson|toJsonl|toXml|toCsv|toParquet|toArrow|toSqlite|toPgCopy|toBulk|stats|cstats|profile -e UTF-8
 created : marcel.bechtiger@domain-sa.ch - 20231026
-modified :
+modified : 20261018 - toCsv reads the dump once (spill file or cached --fieldlist header)
+           20261018 - --workers=N parallel conversion of byte ranges split at R lines
+           20261018 - iterRecords() streaming api, usable with "from hvuConvert import iterRecords"
+           20261018 - --engine=bytes mmap tokenizer, lines engine kept as reference
+           20261018 - -a index record offset sidecar, --from/--to/--key record selection
+           20261018 - --checkpoint / --resume for long conversions
+           20261018 - toParquet / toArrow typed columnar output (optional pyarrow)
+           20261018 - --typing=field stable per field types, --schema cache
+           20261018 - toJsonl compact json lines (orjson if installed)
+           20261018 - streaming xml writer without xmltodict, --compact
+           20261018 - -a profile one pass field profile (hyperloglog, top values), json output
+           20261018 - --sample=N estimated profile from random slots with confidence bounds
+           20261018 - transparent .gz / .zst input and output, (de)compression in a thread
+           20261018 - -e auto encoding sniffing (UTF-8 / ISO-8859-1) before conversion
+           20261018 - progress with throughput and eta, phase timings, --metrics, --cprofile
+           20261018 - --fields / --records / --where projection and filters at parse time
+           20261018 - toSqlite batched load, toPgCopy postgresql copy files and ddl
+           20261018 - toBulk elasticsearch / solr bulk ndjson files, optional concurrent sender
+           20261018 - batch mode : directory or glob input converted concurrently, largest first
+           20261018 - --diff delta conversion between two dumps with a fingerprint index
+           20261018 - --shardrecords / --shardbytes output shards with a manifest
+           20261018 - --byrecord one output per record name, in one pass
+           20261018 - long texts joined once, --textdir side files for oversized values
+           20261018 - --ddl compiled schema : csv/columnar column order, field types and multi occurences
 '''
 
-import getopt, sys
+import getopt, sys, os, io, shutil
+import concurrent.futures
 from datetime import datetime
 import json
-import xmltodict
 import csv
+import pickle
+import tempfile
+import mmap
+import re, struct, bisect, itertools
+import hashlib, math, random
+import threading, queue, gzip, codecs
+import time, contextlib, cProfile, pstats
+import sqlite3, subprocess, glob
+import urllib.request, urllib.error, urllib.parse
+from array import array
+# ddl entries parsed as in ddlViewer.py, next to this script
+import ddlParser
+# optional, only needed by toParquet/toArrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+# optional, only needed by .zst files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+# optional, faster serializer for toJsonl
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # counts of occurence for each field
 fieldCounts = {}
@@ -18,26 +69,147 @@ fieldCounts = {}
 traceEvery = 10000
 # csv delimiter, if used
 csvColDelimiter = "#"
+# bytes read at once by the bytes engine, a chunk ends on a line feed
+bytesChunkSize = 1024 * 1024
+# --where FIELD op value
+predicateRe = re.compile(r"([^=<>!~\s]+)\s*(!=|>=|<=|=|>|<|~)(.*)")
+# -e auto : chunks sampled over the input, bytes per chunk, offsets of invalid chunks reported
+encodingSampleCount = 32
+encodingSampleBytes = 64 * 1024
+encodingReportCount = 20
+# -e auto : first non ascii byte, searched when the sampled chunks are ascii only
+nonAsciiRe = re.compile(rb"[\x80-\xff]")
+# --cprofile : lines of the cumulative stats printed
+metricsProfileLines = 20
+# compressed files : first bytes, levels, blocks queued between the parser and the compressor thread
+compressMagic = {"gz": b"\x1f\x8b", "zst": b"\x28\xb5\x2f\xfd"}
+gzipLevel = 6
+zstdLevel = 3
+compressQueueSize = 8
+# records joined in one write by toJsonl / toXml
+writeBatchSize = 1000
+# toXml : element names already checked
+xmlCheckedNames = set()
+# records sampled to infer the field types with --typing=field
+typeSampleSize = 10000
+intRe = re.compile(r"\s*[+-]?[0-9]+")
+zeroIntRe = re.compile(r"\s*[+-]?0[0-9]+")
+floatRe = re.compile(r"\s*[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?")
+# toSqlite rows per executemany, column types (integer, float, text) per sql dialect
+sqlBatchSize = 10000
+sqlDialectTypes = {"sqlite": ("INTEGER", "REAL", "TEXT"), "postgresql": ("bigint", "double precision", "text")}
+# toBulk / --diff : field of the K line key, --diff : field of the change, fingerprint index signature
+keyFieldName = "HVU_KEY"
+changeFieldName = "HVU_CHANGE"
+fingerprintMagic = b"HVUFPX01"
+# toBulk : retries of a bulk file, first delay and timeout in seconds
+bulkRetries = 5
+bulkRetryDelay = 1.0
+bulkTimeout = 60
+# toBulk : http Content-Encoding of compressed bulk files
+bulkContentEncodings = {"gz": "gzip", "zst": "zstd"}
+# profile : hyperloglog registers 2**p, top values reported and tracked per field,
+# characters of a tracked value, longer ones are cut and end with a hash
+hllPrecision = 12
+profileTopK = 10
+profileTopKCapacity = 1000
+profileTopValueLength = 100
+# --sample : bytes per sampled slot, random seed, standard errors of the bounds (95%)
+sampleWindowBytes = 64 * 1024
+sampleSeed = 1
+sampleZ = 1.96
+# rows per parquet row group / arrow record batch
+arrowBatchSize = 100000
+# --textdir : value of a long text written to a side file
+textRefPrefix = "file:"
+# --byrecord : spill files open at once
+routeOpenFiles = 64
+# batch mode : dumps of a directory, output file extension per action
+batchFileRe = re.compile(r"\.dmp(\.gz|\.zst)?$", re.IGNORECASE)
+batchExtensions = {"toJson": ".json", "toJsonl": ".jsonl", "toXml": ".xml", "toCsv": ".csv", "toParquet": ".parquet",
+    "toArrow": ".arrow", "toSqlite": ".db", "toPgCopy": "", "toBulk": ".ndjson", "profile": ".json"}
+# record index sidecar signature, R and K lines found at any line start
+indexMagic = b"HVUIDX01"
+indexLineRe = re.compile(rb"(?<![^\r\n])[RK][^\r\n]*")
 
 ########## functions ##########
 
 def printUsage():
-    print("usage : hvuConvert.py --in=file.dmp {--out=file.out} --action=toJson|toXml|toCsv|{stats}|cstats {--encoding=UTF-8}")
-    print("or      hvuConvert.py -i file.dmp {-o file.out} -a toJson|toXml|toCsv|{stats}|cstats {-e UTF-8}")
+    print("usage : hvuConvert.py --in=file.dmp {--out=file.out} --action=toJson|toJsonl|toXml|toCsv|toParquet|toArrow|toSqlite|toPgCopy|toBulk|{stats}|cstats|profile {--encoding=UTF-8}")
+    print("or      hvuConvert.py -i file.dmp {-o file.out} -a toJson|toJsonl|toXml|toCsv|toParquet|toArrow|toSqlite|toPgCopy|toBulk|{stats}|cstats|profile {-e UTF-8}")
     print("        file.dmp must be in LCS hvu stream format, file.out will be Json or Xml or Csv or")
     print("        stats - sort by field name, cstats - sort by reverse occurence")
     print("        default is : stats on input file, ISO-8859-1 encoding")
     print("        popular encodings are UTF-8, ISO-8859-1 (Latin-1)")
+    print("options : --fieldlist=file.lst toCsv header cache, one field name per line,")
+    print("          used as header if it exists, else written after the conversion")
+    print("          --tempdir=dir for the toCsv spill file, default is the output file directory")
+    print("          --workers=N convert with N processes, output is the same as a serial run")
+    print("          --engine=bytes|lines parser, bytes (default) scans the memory-mapped dump,")
+    print("          lines is the reference text line parser")
+    print("          -a index builds a record offset index, --index=file.idx (default file.dmp.idx)")
+    print("          --from=N --to=M or --key=value convert/stats only these records, using the index")
+    print("          --checkpoint=MB save a checkpoint (file.out.ckpt) every MB of input,")
+    print("          --resume restart from the last checkpoint, toCsv needs an existing --fieldlist")
+    print("          toJsonl writes one compact utf-8 json record per line (faster with orjson installed)")
+    print("          --compact toXml writes each record on one line, without indentation")
+    print("          profile prints per field null ratio, distinct estimate, lengths, numeric range,")
+    print("          occurrences and top values in one pass, also written as json to --out if given")
+    print("          --sample=N stats/cstats/profile estimated from about N records of random slots,")
+    print("          with record/field count and presence bounds (95%), json written to --out if given")
+    print("          -e auto picks UTF-8 or ISO-8859-1 from chunks sampled over the input, or stops")
+    print("          with the offsets of mixed encodings")
+    print("          --fields=F1,F2 keeps these fields, --records=R1,R2 these record types, --where=\"F op value\"")
+    print("          (op = != > >= < <= ~regex, repeatable, all must match) keeps matching records, applied while parsing,")
+    print("          also to --sample estimates, not by stats / cstats which count the dump lines")
+    print("          --metrics=out.json writes throughput and read/parse, typing, serialize, write timings,")
+    print("          --cprofile=file.prof runs under cProfile (the pid is printed for sampling profilers)")
+    print("          .gz/.zst input is decompressed, .gz/.zst output compressed (zst needs zstandard),")
+    print("          in a separate thread, --compress=gz|zst|none overrides the output file extension")
+    print("          toSqlite loads a sqlite database, toPgCopy writes to the --out directory postgresql copy")
+    print("          files, schema.sql and load.sql : one table per record type, one child table")
+    print("          (record_id, occ, value) per multi occurence field")
+    print("          toBulk writes elasticsearch _bulk (--bulk=es) or solr (--bulk=solr) ndjson files out_000001.ndjson...")
+    print("          of about --bulksize=10 MB, --bulkid=K document id from the K line or from a field,")
+    print("          --bulkindex=name index (default record name in lower case), --bulkurl=http://host:9200/_bulk")
+    print("          posts the files from --bulksenders=2 threads, with retries")
+    print("          -i directory (its *.dmp files) or \"glob/*.dmp\" converts each dump to the --out directory,")
+    print("          --jobs=N at once (default cpus / workers), largest first, with a log per dump and hvuBatch.json")
+    print("          --diff=old.dmp converts only the records inserted, updated or deleted since old.dmp, in field")
+    print("          HVU_CHANGE, matched by record name and --diffkey=K (K line key, in field HVU_KEY) or a field,")
+    print("          with hashed record fingerprints kept in file.dmp.fpx for the next delta")
+    print("          --shardrecords=N and/or --shardbytes=N (or 512K, 100M, 2G) write toJson/toJsonl/toXml/toCsv")
+    print("          to shards out_000001.json... each one a valid file, listed in out.manifest.json")
+    print("          --byrecord writes each record name to its own file out_NAME.ext with its own fields/columns")
+    print("          --textdir=dir writes long texts of more than --textlimit=1M characters to side files")
+    print("          dir/RECORD_FIELD_OCC.txt, the field value is then file:dir/RECORD_FIELD_OCC.txt,")
+    print("          not with --diff, checkpoints and --from / --to / --key")
+    print("          toParquet/toArrow write typed columns (needs pyarrow), --rowgroup=N rows per row group")
+    print("          --typing=value|field|none value types each value (default), field infers one type")
+    print("          per field from the first --typesample=N records (default 10000), none keeps text")
+    print("          --schema=file.json field types cache for --typing=field, used if it exists else written")
+    print("          --ddl=file.ddl (DMDDBE) gives the toCsv/toParquet/toArrow columns in ddl order, without a pre-scan,")
+    print("          the field types (--typing=field, or none) and the multi occurence fields, always written as lists")
 
 def getArguments():
     # get execution arguments
     argumentList = sys.argv[1:]
     options = "hi:o:a:e:"
-    longOptions = ["help", "in=", "out=", "action=", "encoding="]
+    longOptions = ["help", "in=", "out=", "action=", "encoding=", "fieldlist=", "tempdir=", "workers=", "engine=", "index=", "from=", "to=", "key=", "checkpoint=", "resume", "rowgroup=", "typing=", "typesample=", "schema=", "compact", "sample=", "compress=", "metrics=", "cprofile=", "fields=", "records=", "where=", "bulk=", "bulkid=", "bulkindex=", "bulksize=", "bulkurl=", "bulksenders=", "jobs=", "diff=", "diffkey=", "shardrecords=", "shardbytes=", "byrecord", "textdir=", "textlimit=", "ddl="]
     inFile = outFile = ""
     action = "stats"
     # mostly used with Windows dumps
     encoding = "ISO-8859-1"
+    # additional options
+    opts = {"fieldList": "", "tempDir": "", "workers": 1, "engine": "bytes",
+        "index": "", "fromRecord": 0, "toRecord": 0, "key": "",
+        "checkpoint": 0, "resume": False, "rowGroup": arrowBatchSize,
+        "typing": "value", "typeSample": typeSampleSize, "schema": "", "pretty": True,
+        "sample": 0, "compress": "", "metrics": "", "cprofile": "",
+        "fields": "", "records": "", "where": [], "keyName": "",
+        "bulk": "es", "bulkId": "K", "bulkIndex": "", "bulkSize": 10, "bulkUrl": "", "bulkSenders": 2, "jobs": 0,
+        "diff": "", "diffKey": "K", "shardRecords": 0, "shardBytes": 0,
+        "byRecord": False, "textDir": "", "textLimit": 1024 * 1024, "ddl": ""}
     try:
         arguments, values = getopt.getopt(argumentList, options, longOptions)
         for a, v in arguments:
@@ -51,34 +223,218 @@ def getArguments():
                 action = v
             elif a in ("-e", "--encoding"):
                 encoding = v
+            elif a == "--fieldlist":
+                opts["fieldList"] = v
+            elif a == "--tempdir":
+                opts["tempDir"] = v
+            elif a == "--workers":
+                opts["workers"] = int(v)
+            elif a == "--engine":
+                if v not in ("bytes", "lines"):
+                    raise ValueError("invalid engine " + v)
+                opts["engine"] = v
+            elif a == "--index":
+                opts["index"] = v
+            elif a == "--from":
+                opts["fromRecord"] = int(v)
+            elif a == "--to":
+                opts["toRecord"] = int(v)
+            elif a == "--key":
+                opts["key"] = v
+            elif a == "--checkpoint":
+                opts["checkpoint"] = int(v)
+            elif a == "--resume":
+                opts["resume"] = True
+            elif a == "--rowgroup":
+                opts["rowGroup"] = int(v)
+            elif a == "--typing":
+                if v not in ("value", "field", "none"):
+                    raise ValueError("invalid typing " + v)
+                opts["typing"] = v
+            elif a == "--typesample":
+                opts["typeSample"] = int(v)
+            elif a == "--schema":
+                opts["schema"] = v
+            elif a == "--compact":
+                opts["pretty"] = False
+            elif a == "--sample":
+                opts["sample"] = int(v)
+            elif a == "--fields":
+                opts["fields"] = v
+            elif a == "--records":
+                opts["records"] = v
+            elif a == "--where":
+                parsePredicate(v)
+                opts["where"].append(v)
+            elif a == "--bulk":
+                if v not in ("es", "solr"):
+                    raise ValueError("invalid bulk format " + v)
+                opts["bulk"] = v
+            elif a == "--bulkid":
+                opts["bulkId"] = v
+            elif a == "--bulkindex":
+                opts["bulkIndex"] = v
+            elif a == "--bulksize":
+                opts["bulkSize"] = float(v)
+            elif a == "--bulkurl":
+                opts["bulkUrl"] = v
+            elif a == "--bulksenders":
+                opts["bulkSenders"] = int(v)
+            elif a == "--diff":
+                opts["diff"] = v
+            elif a == "--diffkey":
+                opts["diffKey"] = v
+            elif a == "--textdir":
+                opts["textDir"] = v
+            elif a == "--textlimit":
+                opts["textLimit"] = getSize(v)
+            elif a == "--ddl":
+                opts["ddl"] = v
+            elif a == "--byrecord":
+                opts["byRecord"] = True
+            elif a == "--shardrecords":
+                opts["shardRecords"] = int(v)
+            elif a == "--shardbytes":
+                opts["shardBytes"] = getSize(v)
+            elif a == "--jobs":
+                opts["jobs"] = int(v)
+            elif a == "--metrics":
+                opts["metrics"] = v
+            elif a == "--cprofile":
+                opts["cprofile"] = v
+            elif a == "--compress":
+                if v not in ("gz", "zst", "none"):
+                    raise ValueError("invalid compression " + v)
+                opts["compress"] = v
             else:
                 printUsage()
         print("using encoding:", encoding)
-    except getopt.error as err:
+    except (getopt.error, ValueError) as err:
         print (str(err))
         exit(1)
-    return(inFile, outFile, action, encoding)
+    return(inFile, outFile, action, encoding, opts)
+
+def sniffEncoding(inFile):
+    '''
+    pick the encoding from encodingSampleCount chunks spread over the input file (its head if compressed) :
+    UTF-8 if every chunk is valid UTF-8, ISO-8859-1 if the non ascii chunks are not valid UTF-8,
+    mixed chunks are reported with their offsets and stop, when all chunks are ascii the first non ascii
+    byte of the file decides (ISO-8859-1, which decodes any byte, for a compressed file)
+    '''
+    samples = []
+    isWhole = False
+    compression = getInCompression(inFile)
+    try:
+        if compression != "":
+            with openCompressedFile(inFile, compression, "rb") as f:
+                samples.append((0, f.read(encodingSampleCount * encodingSampleBytes)))
+        else:
+            size = os.path.getsize(inFile)
+            with open(inFile, "rb") as f:
+                if size <= encodingSampleCount * encodingSampleBytes:
+                    samples.append((0, f.read()))
+                    isWhole = True
+                else:
+                    for i in range(encodingSampleCount):
+                        offset = (size - encodingSampleBytes) * i // (encodingSampleCount - 1)
+                        f.seek(offset)
+                        samples.append((offset, f.read(encodingSampleBytes)))
+    except OSError as e:
+        print("cannot open inFile")
+        print (str(e))
+        exit(1)
+    utf8Count = 0
+    invalidOffsets = []
+    c1Count = 0
+    for offset, data in samples:
+        if data.isascii():
+            continue
+        # skip a sequence cut at the start, a sequence cut at the end is left pending
+        i = 0
+        while offset > 0 and i < 3 and i < len(data) and 0x80 <= data[i] <= 0xBF:
+            i += 1
+        try:
+            codecs.getincrementaldecoder("UTF-8")().decode(data[i:], final=False)
+            utf8Count += 1
+        except UnicodeDecodeError as e:
+            # first invalid byte of each chunk
+            invalidOffsets.append(offset + i + e.start)
+            c1Count += sum(data.count(bytes([b])) for b in range(0x80, 0xA0))
+    bytesCount = sum(len(data) for offset, data in samples)
+    print("*** encoding sniffed from {0:,} bytes in {1} chunks".format(bytesCount, len(samples)))
+    if not invalidOffsets:
+        if utf8Count == 0 and isWhole:
+            print("*** ascii only, using UTF-8")
+            return("UTF-8")
+        if utf8Count == 0 and compression != "":
+            # an accent after the head is not seen, UTF-8 would stop on a latin-1 byte
+            print("*** warning : the sampled head is ascii only, using ISO-8859-1")
+            print("*** give -e UTF-8 if the dump is UTF-8")
+            return("ISO-8859-1")
+        if utf8Count == 0:
+            # an accent between the chunks is not seen, search the first one
+            with open(inFile, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                match = nonAsciiRe.search(mm)
+                if match is None:
+                    print("*** ascii only, using UTF-8")
+                    return("UTF-8")
+                offset = match.start()
+                data = mm[offset:offset + encodingSampleBytes]
+            try:
+                codecs.getincrementaldecoder("UTF-8")().decode(data, final=False)
+                print("*** sampled chunks ascii only, valid UTF-8 at offset {0:,}, using UTF-8".format(offset))
+                return("UTF-8")
+            except UnicodeDecodeError:
+                print("*** sampled chunks ascii only, not UTF-8 at offset {0:,}, using ISO-8859-1".format(offset))
+                return("ISO-8859-1")
+        print("*** valid UTF-8, using UTF-8")
+        return("UTF-8")
+    if utf8Count > 0:
+        print("*** mixed encodings : {0} chunks valid UTF-8, {1} chunks with invalid UTF-8 at offsets".format(utf8Count,
+            len(invalidOffsets)))
+        print(", ".join("{0:,}".format(o) for o in invalidOffsets[:encodingReportCount]))
+        print("check these offsets and give the encoding with -e")
+        abnormalTermination()
+    print("*** not UTF-8 (first invalid byte at offset {0:,}), using ISO-8859-1".format(invalidOffsets[0]))
+    if c1Count > 0:
+        print("*** {0:,} bytes in 0x80-0x9F, -e cp1252 may fit better".format(c1Count))
+    return("ISO-8859-1")
 
 def openInFile(inFile, encoding):
-    # open hvu stream input file
+    # open hvu stream input file, .gz / .zst files are decompressed in a thread
     try:
-        inF = open(inFile, "r", encoding=encoding)
+        compression = getInCompression(inFile)
+        if compression != "":
+            inF = io.TextIOWrapper(openCompressedFile(inFile, compression, "rb"), encoding=encoding)
+        else:
+            inF = open(inFile, "r", encoding=encoding)
     except Exception as e:
         print("cannot open inFile")
         print (str(e))
         exit(1)
     return(inF)
 
-def openOutFile(outFile, encoding):
-    # open json/xml output file
+def openOutFile(outFile, encoding, isBinary=False, compression=""):
+    # open json/xml/csv output file, parquet/arrow are binary, compressed in a thread if asked
     try:
-        outF = open(outFile, 'w', encoding=encoding)
+        if compression != "":
+            outF = openCompressedFile(outFile, compression, "wb")
+            if not isBinary:
+                outF = io.TextIOWrapper(outF, encoding=encoding)
+        elif isBinary:
+            outF = open(outFile, 'wb')
+        else:
+            outF = open(outFile, 'w', encoding=encoding)
     except Exception as e:
         print("cannot open outFile")
         print (str(e))
         exit(1)
     return(outF)
 
+def getOutEncoding(action, encoding):
+    # json lines are always utf-8, other outputs keep the input encoding
+    return("UTF-8" if action == "toJsonl" else encoding)
+
 def getRecordName(line):
     recordName = line[3:32].strip()
     #print("recordName:", recordName)
@@ -108,10 +464,10 @@ def doStats(inF, action, encoding):
     recordName = fieldName = ""
     lineCount = 0
     try:
-        while line := inF.readline():
+        for line in inF:
             lineCount += 1
             if lineCount % (traceEvery * 50) == 0:
-                print("{0:,} lines".format(lineCount))
+                metrics.progress(lineCount, "lines")
             if len(line) < 3:
                 #print("short line", len(line), lineCount, line)
                 countOfUndef += 1
@@ -190,11 +546,11 @@ def setValueType(s):
             return(v)
     return(s)
 
-def appendToFieldBuffer(previousFieldName, fieldValue, subfieldfList):
+def appendToFieldBuffer(previousFieldName, fieldValue, subfieldfList, isTyped=True):
     # json array is an [e1, ..., en] list
     if previousFieldName == "" or fieldValue == "":
         return()
-    v = setValueType(fieldValue)
+    v = setValueType(fieldValue) if isTyped else fieldValue
     subfieldfList.append(v)
     return()
 
@@ -206,12 +562,65 @@ def appendToFieldsDict(fieldName, subfieldList, fieldsDict):
     subfieldList = []
     return()
 
-def getRecordDictionary(inF, recordCount, recordName):
+class LongText:
+    '''
+    text of the L/D and continuation lines of the current field, kept as a list of parts
+    joined once when the field ends, or written to the side file textDir/RECORD_FIELD_OCC.txt
+    (UTF-8) once longer than textLimit characters, the field value is then textRefPrefix
+    and the side file name
+    '''
+    def __init__(self, textDir="", textLimit=0):
+        self.textDir = textDir
+        self.textLimit = textLimit if textDir != "" else sys.maxsize
+        self.parts = []
+        self.size = 0
+        self.f = None
+        self.reference = ""
+
+    def add(self, s):
+        # True once the text is longer than textLimit and not yet in a side file
+        if self.f is not None:
+            self.f.write(s)
+            return(False)
+        self.parts.append(s)
+        self.size += len(s)
+        return(self.size > self.textLimit)
+
+    def spill(self, fieldValue, recordNumber, fieldName, fieldOcc):
+        # move the text to its side file, return the new field value
+        textFile = os.path.join(self.textDir, "%09d_%s_%d.txt" % (recordNumber, re.sub(r"[^\w.-]", "_", fieldName), fieldOcc))
+        self.f = open(textFile, "w", encoding="UTF-8")
+        self.f.write(fieldValue)
+        self.f.write("".join(self.parts))
+        self.parts = []
+        self.reference = textRefPrefix + textFile
+        return("")
+
+    def take(self, fieldValue):
+        # the whole value of the field, its text reset
+        self.size = 0
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            return(self.reference)
+        fieldValue += "".join(self.parts)
+        self.parts = []
+        return(fieldValue)
+
+def getRecordDictionary(inF, recordCount, recordName, fieldNames=None, isTyped=True, keyName=None, longText=None):
     # read hvu stream and return one record occurenca as dictionary
+    # fieldNames, if given, is a set collecting every V/E field name met, even empty ones
+    # values are typed with setValueType, or left as text when not isTyped
+    # the K line key is kept as field keyName, if given
+    # L/D and continuation lines are gathered by longText (LongText)
+    if longText is None:
+        longText = LongText()
     recordDict, fieldsDict = {}, {}
     subfieldList = []
     fieldName = previousFieldName = fieldValue = ""
     fieldOcc = previousFieldOcc = lineCount = 0
+    # a record is open once its R line (read by the previous call) or a field is met
+    isOpen = recordCount > 1
     #print("recordCount:", recordCount)
 
     # beware that some hvu lines migt be crap, aka ending with ^M
@@ -226,35 +635,51 @@ def getRecordDictionary(inF, recordCount, recordName):
         match lineCode:
             # R  EMPLOYEE                            <<< record # 1 >>>
             case "R":
-                recordName = getRecordName(line)
-                # dump previous record, if any
-                if lineCount > 1:
-                    appendToFieldBuffer(previousFieldName, fieldValue, subfieldList)
+                # dump previous record, if any, under its own name and
+                # return the name of the next record whose R line is read
+                if isOpen:
+                    if longText.size:
+                        fieldValue = longText.take(fieldValue)
+                    appendToFieldBuffer(previousFieldName, fieldValue, subfieldList, isTyped)
                     appendToFieldsDict(previousFieldName, subfieldList, fieldsDict)
                     recordDict[recordName] = fieldsDict
-                    return(recordName, recordDict, False)
+                    return(getRecordName(line), recordDict, False)
+                recordName = getRecordName(line)
+                isOpen = True
             # V  COMM(1)=400.00
             case "V":
-                appendToFieldBuffer(previousFieldName, fieldValue, subfieldList)
+                if longText.size:
+                    fieldValue = longText.take(fieldValue)
+                appendToFieldBuffer(previousFieldName, fieldValue, subfieldList, isTyped)
                 fieldName, fieldOcc = getFieldData(line)
+                if fieldNames is not None:
+                    fieldNames.add(fieldName)
                 if fieldOcc == 1:
                     appendToFieldsDict(previousFieldName, subfieldList, fieldsDict)
                     subfieldList = []
                 else:
                     appendToFieldsDict(fieldName, subfieldList, fieldsDict)
                 previousFieldName, previousFieldOcc = fieldName, fieldOcc
-                fieldValue = line.split("=")[1]
-            # ignore K, C lines
+                fieldValue = line.split("=", 1)[1]
+                isOpen = True
             # K  keyValue
+            case "K":
+                if keyName is not None:
+                    fieldsDict[keyName] = line[3:].strip()
+            # ignore C lines
             # C...comment...
-            case "C" | "K":
+            case "C":
                 s = ""
             # E  DISPLAY_TI(1) is followeb by
             # L70La monnaie et... or
             # D  La monnaie et...
             case "E":
-                appendToFieldBuffer(previousFieldName, fieldValue, subfieldList)
+                if longText.size:
+                    fieldValue = longText.take(fieldValue)
+                appendToFieldBuffer(previousFieldName, fieldValue, subfieldList, isTyped)
                 fieldName, fieldOcc = getFieldData(line)
+                if fieldNames is not None:
+                    fieldNames.add(fieldName)
                 if fieldOcc == 1:
                     appendToFieldsDict(previousFieldName, subfieldList, fieldsDict)
                     subfieldList = []
@@ -262,120 +687,2666 @@ def getRecordDictionary(inF, recordCount, recordName):
                     appendToFieldsDict(fieldName, subfieldList, fieldsDict)
                 previousFieldName, previousFieldOcc = fieldName, fieldOcc
                 fieldValue = ""
+                isOpen = True
             case "L" | "D":
-                fieldValue += line[3:]
+                if longText.add(line[3:]) and previousFieldName != "":
+                    fieldValue = longText.spill(fieldValue, recordCount, previousFieldName, previousFieldOcc)
             # some ill formated line is continued due to CR-LF in text
             case _:
-                fieldValue += line
+                if longText.add(line) and previousFieldName != "":
+                    fieldValue = longText.spill(fieldValue, recordCount, previousFieldName, previousFieldOcc)
     #sortedFieldsDict = dict(sorted(fieldsDict.items()))
     #recordDict[recordName] = sortedFieldsDict
     # handle case where last line was "L" or "D"
+    if longText.size:
+        fieldValue = longText.take(fieldValue)
     if fieldValue != "":
-        appendToFieldBuffer(previousFieldName, fieldValue, subfieldList)
+        appendToFieldBuffer(previousFieldName, fieldValue, subfieldList, isTyped)
         appendToFieldsDict(previousFieldName, subfieldList, fieldsDict)
     recordDict[recordName] = fieldsDict
     return(recordName, recordDict, True)
 
-def getFieldList(inF, encoding):
-    # read hvu stream and get field names
-    header = []
-    lineCount = 0
-    print("parse input file to get non-empty fieldlist for csv header")
+def iterRecords(inFile, encoding="ISO-8859-1", fieldNames=None, engine="lines", isTyped=True, recordFilter=None, keyName=None,
+    longText=None, progress=None):
+    '''
+    stream api : yield (recordName, fieldsDict) for each record of a hvu stream,
+    inFile is a file name (.gz/.zst decompressed) or a text file object, one record is held at a time,
+    fieldNames, if given, is a set collecting every V/E field name met,
+    engine is "lines" (reference text parser) or "bytes" (mmap tokenizer),
+    values are typed with setValueType unless isTyped is False,
+    recordFilter (RecordFilter) keeps some fields, record types or matching records,
+    keyName, if given, is the field receiving the K line key of the record,
+    longText (LongText), if given, writes the long texts to side files,
+    progress (Metrics), if given, receives the input position of the bytes engine
+        for recordName, fieldsDict in iterRecords("tour_employee.dmp"):
+            print(recordName, fieldsDict["ENO"])
+    '''
+    if engine == "bytes":
+        yield from iterRecordsBytes(inFile, getattr(inFile, "encoding", encoding), fieldNames, isTyped=isTyped,
+            recordFilter=recordFilter, keyName=keyName, longText=longText, progress=progress)
+        return
+    if recordFilter is not None:
+        metNames = set() if fieldNames is not None else None
+        yield from filterRecords(iterRecords(inFile, encoding, metNames, engine, isTyped, keyName=keyName,
+            longText=longText), recordFilter, fieldNames, metNames)
+        return
+    if isinstance(inFile, str):
+        compression = getInCompression(inFile)
+        with open(inFile, "r", encoding=encoding) if compression == "" else \
+            io.TextIOWrapper(openCompressedFile(inFile, compression, "rb"), encoding=encoding) as inF:
+            yield from iterRecords(inF, encoding, fieldNames, engine, isTyped, keyName=keyName, longText=longText)
+        return
+    if longText is None:
+        longText = LongText()
+    recordCount = 0
+    recordName = ""
+    while True:
+        recordCount += 1
+        recordName, recordDict, isLastRecord = getRecordDictionary(inFile, recordCount, recordName, fieldNames, isTyped,
+            keyName, longText)
+        thisRecordName, fieldsDict = next(iter(recordDict.items()))
+        # an empty input has no record at all
+        if isLastRecord and recordCount == 1 and thisRecordName == "" and not fieldsDict:
+            return
+        yield(thisRecordName, fieldsDict)
+        if isLastRecord:
+            return
+
+def iterRecordsBytes(inFile, encoding="ISO-8859-1", fieldNames=None, start=0, end=None, isTyped=True, recordFilter=None,
+    keyName=None, longText=None, progress=None):
+    '''
+    bytes engine of iterRecords : memory-map the dump and scan raw lines,
+    field names and occurences are found with bytes.find, only the emitted
+    values are decoded, records are the same as with getRecordDictionary,
+    inFile is a file name or a file object, [start, end[ a byte range,
+    progress (Metrics), if given, gets the end of the last chunk read as position
+    '''
+    if isinstance(inFile, str):
+        compression = getInCompression(inFile)
+        with open(inFile, "rb") if compression == "" else openCompressedFile(inFile, compression, "rb") as inF:
+            yield from iterRecordsBytes(inF, encoding, fieldNames, start, end, isTyped, recordFilter, keyName, longText,
+                progress)
+        return
+    inFile = getattr(inFile, "buffer", inFile)
     try:
-        while line := inF.readline():
-            lineCount +=1
-            if lineCount % (traceEvery * 50) == 0:
-                print("{0:,} lines".format(lineCount))
-            if len(line) < 3:
-                next
-            line = line.rstrip()
-            lineCode = line[0:1]
-            match lineCode:
-                # V  COMM(1)=400.00
-                case "V":
-                    fieldName = getFieldNameStats(line)
-                # E  DISPLAY_TI(1)
-                case "E":
-                    fieldName = getFieldNameStats(line)
-                case "R" | "K" | "L" | "D" | "C":
-                    next
-                case _:
-                    next
+        fd = inFile.fileno()
+    except OSError:
+        # not a plain file (decompressed stream) : read it chunk by chunk
+        yield from scanRecordsBytes(iterStreamChunks(inFile, progress), encoding, fieldNames, isTyped, recordFilter, keyName,
+            longText)
+        return
+    if os.fstat(fd).st_size == 0:
+        return
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+        chunks = iterMmapChunks(mm, start, len(mm) if end is None else end, progress)
+        yield from scanRecordsBytes(chunks, encoding, fieldNames, isTyped, recordFilter, keyName, longText)
+
+def iterMmapChunks(mm, start, end, progress=None):
+    # chunks of about bytesChunkSize bytes of [start, end[, each one ending on a line feed,
+    # the chunk end is the position of progress if given
+    pos = start
+    while pos < end:
+        chunkEnd = mm.rfind(b"\n", pos, min(pos + bytesChunkSize, end)) + 1
+        if chunkEnd == 0:
+            # no line end in a full chunk, take the whole long line
+            chunkEnd = mm.find(b"\n", pos, end) + 1 or end
+        yield(mm[pos:chunkEnd])
+        pos = chunkEnd
+        if progress is not None:
+            progress.position = pos
+
+def scanRecordsBytes(chunks, encoding, fieldNames, isTyped=True, recordFilter=None, keyName=None, longText=None):
+    # same state machine as getRecordDictionary, over whole chunks of lines
+    # split like universal newlines (bytes.splitlines breaks on \n, \r and \r\n)
+    # fields not parsed for recordFilter are never split, concatenated nor typed,
+    # the lines of records of other types are passed over
+    if longText is None:
+        longText = LongText()
+    names = {}
+    typeValue = setValueType if isTyped else str
+    recordCount = 0
+    recordName = ""
+    fieldsDict = {}
+    subfieldList = []
+    previousFieldName = fieldValue = ""
+    isOpen = False
+    isSkippedRecord = False
+    for chunk in chunks:
+        for line in chunk.splitlines():
+            lineCode = line[:1]
+            if isSkippedRecord and lineCode != b"R":
+                continue
+            # V  COMM(1)=400.00
+            # E  DISPLAY_TI(1)
+            if lineCode == b"V" or lineCode == b"E":
+                # appendToFieldBuffer and appendToFieldsDict inlined
+                if longText.size:
+                    fieldValue = longText.take(fieldValue)
+                if fieldValue != "" and previousFieldName != "":
+                    subfieldList.append(typeValue(fieldValue))
+                i = line.find(b"(", 3)
+                j = line.find(b")", i + 1)
+                if i < 0:
+                    raise ValueError("missing field occurence: " + line.decode(encoding))
+                k = line[3:i]
+                fieldName = names.get(k)
+                if fieldName is None:
+                    fieldName = names[k] = k.decode(encoding)
+                    if recordFilter is not None and not recordFilter.isParsed(fieldName):
+                        # "" marks a skipped field
+                        fieldName = names[k] = ""
+                    elif fieldNames is not None and (recordFilter is None or recordFilter.isKept(fieldName)):
+                        fieldNames.add(fieldName)
+                if fieldName == "":
+                    # skipped field : close the previous one, the field lines are passed over
+                    n = len(subfieldList)
+                    if n > 1:
+                        fieldsDict[previousFieldName] = subfieldList
+                    elif n == 1:
+                        fieldsDict[previousFieldName] = subfieldList[0]
+                    subfieldList = []
+                    previousFieldName = fieldValue = ""
+                    isOpen = True
+                    continue
+                fieldOcc = int(line[i + 1:j] if j >= 0 else line[i + 1:])
+                n = len(subfieldList)
+                if fieldOcc == 1:
+                    if n > 1:
+                        fieldsDict[previousFieldName] = subfieldList
+                    elif n == 1:
+                        fieldsDict[previousFieldName] = subfieldList[0]
+                    subfieldList = []
+                elif n > 1:
+                    fieldsDict[fieldName] = subfieldList
+                elif n == 1:
+                    fieldsDict[fieldName] = subfieldList[0]
+                previousFieldName = fieldName
+                if lineCode == b"V":
+                    i = line.find(b"=")
+                    if i < 0:
+                        raise ValueError("missing field value: " + line.decode(encoding))
+                    fieldValue = line[i + 1:].decode(encoding).rstrip()
+                else:
+                    fieldValue = ""
+                isOpen = True
+            # L70La monnaie et... or
+            # D  La monnaie et...
+            elif lineCode == b"L" or lineCode == b"D":
+                if previousFieldName != "" and longText.add(line.decode(encoding).rstrip()[3:]):
+                    fieldValue = longText.spill(fieldValue, recordCount + 1, previousFieldName, fieldOcc)
+            # K  keyValue, kept as field keyName if given
+            elif lineCode == b"K":
+                if keyName is not None:
+                    fieldsDict[keyName] = line[3:].decode(encoding).strip()
+            # ignore C lines
+            elif lineCode == b"C":
+                continue
+            # R  EMPLOYEE                            <<< record # 1 >>>
+            elif lineCode == b"R":
+                if isOpen:
+                    if longText.size:
+                        fieldValue = longText.take(fieldValue)
+                    appendToFieldBuffer(previousFieldName, fieldValue, subfieldList, isTyped)
+                    appendToFieldsDict(previousFieldName, subfieldList, fieldsDict)
+                    recordCount += 1
+                    if recordFilter is None:
+                        yield(recordName, fieldsDict)
+                    elif not isSkippedRecord and recordFilter.accept(recordName, fieldsDict):
+                        yield(recordName, recordFilter.project(fieldsDict))
+                    fieldsDict = {}
+                    subfieldList = []
+                    previousFieldName = fieldValue = ""
+                recordName = getRecordName(line.decode(encoding).rstrip())
+                isSkippedRecord = recordFilter is not None and recordFilter.records is not None \
+                    and recordName not in recordFilter.records
+                isOpen = True
+            # some ill formated line is continued due to CR-LF in text
+            elif previousFieldName != "" and longText.add(line.decode(encoding).rstrip()):
+                fieldValue = longText.spill(fieldValue, recordCount + 1, previousFieldName, fieldOcc)
+    if longText.size:
+        fieldValue = longText.take(fieldValue)
+    if fieldValue != "":
+        appendToFieldBuffer(previousFieldName, fieldValue, subfieldList, isTyped)
+        appendToFieldsDict(previousFieldName, subfieldList, fieldsDict)
+    # an empty input has no record at all
+    if recordCount > 0 or recordName != "" or fieldsDict:
+        if recordFilter is None:
+            yield(recordName, fieldsDict)
+        elif not isSkippedRecord and recordFilter.accept(recordName, fieldsDict):
+            yield(recordName, recordFilter.project(fieldsDict))
+    return
+
+########## metrics ##########
+
+class Metrics:
+    # progress, throughput, eta and phase timings of the run, reported with --metrics
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.inSize = 0
+        self.position = 0
+        self.getPosition = None
+        self.recordCount = 0
+        self.phases = {}
+        self.info = {}
+        self.outFile = ""
+        self.profiler = None
+        self.profileFile = ""
+
+    def setInput(self, inFile, inF, isEta=True):
+        # eta from the input bytes consumed, read position of the lines engine or chunk end of the bytes engine
+        self.info["inFile"] = inFile
+        self.info["inBytes"] = os.path.getsize(inFile)
+        if isEta and getInCompression(inFile) == "":
+            self.inSize = self.info["inBytes"]
+        raw = getattr(getattr(inF, "buffer", None), "raw", None)
+        if self.inSize > 0 and raw is not None and hasattr(raw, "tell"):
+            self.getPosition = raw.tell
+
+    def progress(self, count, unit="records"):
+        elapsed = time.perf_counter() - self.start
+        position = max(self.position, self.getPosition() if self.getPosition is not None else 0)
+        s = "{0:,} {1}, {2:,.0f} {1}/s".format(count, unit, count / elapsed if elapsed > 0 else 0)
+        if position > 0:
+            s += ", {0:,.1f} MB/s".format(position / 1024 / 1024 / elapsed)
+        if self.inSize > 0 and 0 < position <= self.inSize:
+            eta = int(elapsed * (self.inSize - position) / position)
+            s += ", {0:.1%}, eta {1}:{2:02d}:{3:02d}".format(position / self.inSize, eta // 3600, eta // 60 % 60, eta % 60)
+        print(s)
+
+    def timed(self, records, phase):
+        # records of generator records, the time spent producing them added to phase
+        self.phases.setdefault(phase, 0.0)
+        count = 0
+        records = iter(records)
+        while True:
+            t = time.perf_counter()
+            try:
+                record = next(records)
+            except StopIteration:
+                self.phases[phase] += time.perf_counter() - t
+                break
+            self.phases[phase] += time.perf_counter() - t
+            count += 1
+            yield(record)
+        if phase == "parse":
+            self.recordCount += count
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.perf_counter() - t
+
+    def getPhases(self):
+        # exclusive seconds : typing without parse, serialize is the rest of convert
+        phases = dict(self.phases)
+        parse = phases.get("parse", 0.0)
+        if "typing" in phases:
+            phases["typing"] = max(phases["typing"] - parse, 0.0)
+        convert = phases.pop("convert", None)
+        if convert is not None and "ranges" not in phases:
+            phases["serialize"] = max(convert - parse - phases.get("typing", 0.0) - phases.get("write", 0.0)
+                - phases.get("send", 0.0), 0.0)
+        order = ["parse", "typing", "serialize", "write", "send", "ranges", "merge"]
+        return({k: round(phases[k], 3) for k in sorted(phases, key=lambda k: order.index(k) if k in order else len(order))})
+
+    def startProfiler(self, profileFile):
+        self.profileFile = profileFile
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def finish(self):
+        # at normal termination : timings summary, cProfile stats and --metrics report
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profileFile)
+            pstats.Stats(self.profiler).sort_stats("cumulative").print_stats(metricsProfileLines)
+            print("*** cProfile stats written to", self.profileFile)
+        elapsed = time.perf_counter() - self.start
+        phases = self.getPhases()
+        if phases:
+            print("*** timings :", ", ".join("{0} {1:.2f}s".format(k, v) for k, v in phases.items()),
+                "total {0:.2f}s".format(elapsed))
+        if self.outFile == "":
+            return()
+        report = dict(self.info)
+        report.update({"seconds": round(elapsed, 3), "records": self.recordCount,
+            "recordsPerSecond": round(self.recordCount / elapsed) if elapsed > 0 else 0,
+            "megaBytesPerSecond": round(self.info.get("inBytes", 0) / 1024 / 1024 / elapsed, 3) if elapsed > 0 else 0,
+            "phases": phases, "peakRssMegaBytes": round(getPeakRss() / 1024 / 1024, 1)})
+        with open(self.outFile, "w") as f:
+            json.dump(report, f, indent=2)
+        print("*** metrics written to", self.outFile)
+        return()
+
+class TimedWriter:
+    # text output file whose writes are timed in the "write" phase, other attributes are the file's
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, s):
+        t = time.perf_counter()
+        n = self.f.write(s)
+        metrics.phases["write"] = metrics.phases.get("write", 0.0) + time.perf_counter() - t
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+def getPeakRss():
+    # peak resident memory of this process in bytes, kilobytes on Linux, bytes on macOS
+    try:
+        import resource
+    except ImportError:
+        return(0)
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return(peakRss if sys.platform == "darwin" else peakRss * 1024)
+
+# metrics of this run
+metrics = Metrics()
+
+########## compressed files ##########
+
+class QueueReader(io.RawIOBase):
+    # raw stream of the blocks a thread reads (and decompresses) from file object f
+    def __init__(self, f, name):
+        self.f = f
+        self.name = name
+        self.queue = queue.Queue(maxsize=compressQueueSize)
+        self.block = b""
+        self.pos = 0
+        self.isEof = False
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        try:
+            while not self.stop.is_set():
+                block = self.f.read(bytesChunkSize)
+                self.queue.put(block)
+                if not block:
+                    return
+        except BaseException as e:
+            self.queue.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.pos >= len(self.block):
+            if self.isEof:
+                return 0
+            block = self.queue.get()
+            if isinstance(block, BaseException):
+                raise block
+            if not block:
+                self.isEof = True
+                return 0
+            self.block, self.pos = block, 0
+        n = min(len(b), len(self.block) - self.pos)
+        b[:n] = self.block[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            # unblock the thread if it waits on a full queue
+            self.stop.set()
+            while self.thread.is_alive():
+                try:
+                    self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.f.close()
+        super().close()
+
+class QueueWriter(io.RawIOBase):
+    # raw stream whose writes a thread passes to (compressing) file object f
+    def __init__(self, f, name):
+        self.f = f
+        self.name = name
+        self.queue = queue.Queue(maxsize=compressQueueSize)
+        self.error = None
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            block = self.queue.get()
+            if block is None:
+                return
+            # after an error, keep emptying the queue so that writers do not block
+            if self.error is None:
+                try:
+                    self.f.write(block)
+                except BaseException as e:
+                    self.error = e
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(bytes(b))
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+            self.f.close()
+        super().close()
+        if self.error is not None:
+            raise self.error
+
+def getInCompression(inFile):
+    # "gz" or "zst" from the first bytes of the input file, "" if not compressed
+    try:
+        with open(inFile, "rb") as f:
+            magic = f.read(4)
+    except OSError:
+        return("")
+    for kind, m in compressMagic.items():
+        if magic.startswith(m):
+            return(kind)
+    return("")
+
+def getOutCompression(outFile, opts):
+    # --compress, else the .gz / .zst extension of the output file
+    if opts["compress"] != "":
+        return("" if opts["compress"] == "none" else opts["compress"])
+    for kind in compressMagic:
+        if outFile.endswith("." + kind):
+            return(kind)
+    return("")
+
+def openCompressedFile(fileName, kind, mode):
+    # binary stream of a gz / zst file, (de)compressed in a thread, mode "rb" or "wb"
+    if kind == "zst" and zstandard is None:
+        print("zst files need zstandard : pip install zstandard")
+        abnormalTermination()
+    if kind == "gz":
+        f = gzip.open(fileName, mode, compresslevel=gzipLevel)
+    elif mode == "rb":
+        f = zstandard.ZstdDecompressor().stream_reader(open(fileName, "rb"), read_across_frames=True, closefd=True)
+    else:
+        f = zstandard.ZstdCompressor(level=zstdLevel, threads=-1).stream_writer(open(fileName, "wb"), closefd=True)
+    if mode == "rb":
+        return(io.BufferedReader(QueueReader(f, fileName), bytesChunkSize))
+    return(io.BufferedWriter(QueueWriter(f, fileName), bytesChunkSize))
+
+def iterStreamChunks(f, progress=None):
+    # chunks of whole lines of binary stream f, like iterMmapChunks
+    pos = 0
+    tail = b""
+    while True:
+        block = f.read(bytesChunkSize)
+        if not block:
+            break
+        block = tail + block
+        i = block.rfind(b"\n") + 1
+        if i == 0:
+            tail = block
+            continue
+        tail = block[i:]
+        pos += i
+        if progress is not None:
+            progress.position = pos
+        yield(block[:i])
+    if tail:
+        yield(tail)
+
+########## projection / filters ##########
+
+class RecordFilter:
+    # --fields projection, --records record types and --where predicates, applied by the parsers
+    def __init__(self, fields=None, records=None, wheres=()):
+        self.fields = fields
+        self.records = records
+        self.predicates = [parsePredicate(w) for w in wheres]
+        # fields to parse : the projection and the fields tested by predicates
+        self.parseFields = None
+        if fields is not None:
+            self.parseFields = fields | {p[0] for p in self.predicates}
+
+    def isParsed(self, fieldName):
+        return self.parseFields is None or fieldName in self.parseFields
+
+    def isKept(self, fieldName):
+        return self.fields is None or fieldName in self.fields
+
+    def accept(self, recordName, fieldsDict):
+        # record of a selected type matching every predicate
+        if self.records is not None and recordName not in self.records:
+            return False
+        for predicate in self.predicates:
+            if not matchPredicate(predicate, fieldsDict.get(predicate[0])):
+                return False
+        return True
+
+    def project(self, fieldsDict):
+        # drop the fields only parsed for the predicates
+        if self.fields is None or len(self.parseFields) == len(self.fields):
+            return fieldsDict
+        return {k: v for k, v in fieldsDict.items() if k in self.fields}
+
+def parsePredicate(where):
+    # "FIELD op value", op in = != > >= < <= ~ (regular expression search)
+    m = predicateRe.fullmatch(where.strip())
+    if m is None:
+        raise ValueError("invalid predicate " + where)
+    fieldName, op, literal = m.group(1), m.group(2), m.group(3).strip()
+    number = float(literal) if floatRe.fullmatch(literal) else None
+    regex = re.compile(literal) if op == "~" else None
+    return((fieldName, op, literal, number, regex))
+
+def matchPredicate(predicate, v):
+    # a missing field never matches, a multi occurrence field matches if one value does
+    fieldName, op, literal, number, regex = predicate
+    if v is None:
+        return(False)
+    for x in (v if type(v) == list else (v,)):
+        if op == "~":
+            if regex.search(str(x)):
+                return(True)
+            continue
+        if number is not None and (type(x) in (int, float) or floatRe.fullmatch(x)):
+            a, b = float(x), number
+        else:
+            a, b = str(x), literal
+        if (op == "=" and a == b) or (op == "!=" and a != b) or (op == ">" and a > b) \
+            or (op == ">=" and a >= b) or (op == "<" and a < b) or (op == "<=" and a <= b):
+            return(True)
+    return(False)
+
+def getRecordFilter(opts):
+    # filter of the --fields, --records and --where options, None without any
+    if opts["fields"] == "" and opts["records"] == "" and not opts["where"]:
+        return(None)
+    fields = set(opts["fields"].split(",")) if opts["fields"] != "" else None
+    if fields is not None and opts.get("keyName", "") != "":
+        # the K line key is kept by the projection
+        fields.add(opts["keyName"])
+    records = set(opts["records"].split(",")) if opts["records"] != "" else None
+    return(RecordFilter(fields, records, opts["where"]))
+
+def filterRecords(records, recordFilter, fieldNames=None, metNames=None):
+    # same filter as the bytes engine, applied to the records of the lines engine,
+    # metNames is the set the parser fills with the field names of the last record
+    for recordName, fieldsDict in records:
+        if recordFilter.records is not None and recordName not in recordFilter.records:
+            if metNames is not None:
+                metNames.clear()
+            continue
+        if recordFilter.parseFields is not None:
+            fieldsDict = {k: v for k, v in fieldsDict.items() if k in recordFilter.parseFields}
+        if fieldNames is not None:
+            fieldNames.update(k for k in metNames if recordFilter.isKept(k))
+            metNames.clear()
+        if recordFilter.accept(recordName, fieldsDict):
+            yield(recordName, recordFilter.project(fieldsDict))
+
+########## field typing ##########
+
+def getValueKind(s):
+    # "int", "float" or "str" without converting, "zint" for integers with leading zeros
+    if intRe.fullmatch(s):
+        return("zint" if zeroIntRe.fullmatch(s) else "int")
+    if floatRe.fullmatch(s):
+        return("float")
+    return("str")
+
+def inferFieldTypes(sample, fieldTypes):
+    # set the type of the fields met in the sampled records : int if all values
+    # are integers, float if all are numbers, else str (also to keep leading zeros)
+    kinds = {}
+    for recordName, fieldsDict in sample:
+        for fieldName, v in fieldsDict.items():
+            fieldKinds = kinds.setdefault(fieldName, set())
+            for x in (v if type(v) == list else [v]):
+                fieldKinds.add(getValueKind(x))
+    for fieldName, fieldKinds in kinds.items():
+        if fieldName not in fieldTypes:
+            fieldTypes[fieldName] = getKindsType(fieldKinds)
+    return()
+
+def getKindsType(kinds):
+    # int if all values are integers, float if all are numbers, else str
+    if not kinds:
+        return("str")
+    if set(kinds) == {"int"}:
+        return("int")
+    if set(kinds) <= {"int", "float"}:
+        return("float")
+    return("str")
+
+def typeRecordsByField(records, fieldTypes, sampleSize=typeSampleSize):
+    '''
+    type text records with one stable type per field : fieldTypes {field: "int"|"float"|"str"}
+    is inferred from the first sampleSize records when empty, fields first met later
+    are str, a value not matching its field type is kept as text and counted,
+    values are checked with regular expressions, no exception per value
+    '''
+    sample = []
+    if not fieldTypes:
+        sample = list(itertools.islice(records, sampleSize))
+        inferFieldTypes(sample, fieldTypes)
+        print('***', len(fieldTypes), "field types inferred from", len(sample), "records")
+    # one (match, cast) per field, None for text fields
+    converters = {"int": (intRe.fullmatch, int), "float": (floatRe.fullmatch, float), "str": None}
+    fieldConverters = {fieldName: converters[t] for fieldName, t in fieldTypes.items()}
+    mismatchCount = 0
+    for recordName, fieldsDict in itertools.chain(sample, records):
+        for fieldName, v in fieldsDict.items():
+            try:
+                converter = fieldConverters[fieldName]
+            except KeyError:
+                fieldTypes[fieldName] = "str"
+                converter = fieldConverters[fieldName] = None
+            if converter is None:
+                continue
+            match, cast = converter
+            if type(v) == list:
+                for i, x in enumerate(v):
+                    if match(x):
+                        v[i] = cast(x)
+                    else:
+                        mismatchCount += 1
+            elif match(v):
+                fieldsDict[fieldName] = cast(v)
+            else:
+                mismatchCount += 1
+        yield(recordName, fieldsDict)
+    if mismatchCount > 0:
+        print("***", mismatchCount, "values kept as text, not matching their field type")
+    return
+
+def readSchema(schemaFile):
+    # cached field types {field: "int"|"float"|"str"}, empty if the file does not exist
+    if schemaFile == "" or not os.path.exists(schemaFile):
+        return({})
+    try:
+        with open(schemaFile, "r") as f:
+            fieldTypes = json.load(f)
     except Exception as e:
-        print("read error, line", lineCount)
-        print("try using another encoding, used", encoding)
+        print("cannot read schema", schemaFile)
+        print (str(e))
+        abnormalTermination()
+    print('***', len(fieldTypes), "field types from", schemaFile)
+    return(fieldTypes)
+
+def writeSchema(schemaFile, fieldTypes, fieldNames=()):
+    # save the field types for the next conversions, fields without value are str
+    if schemaFile == "" or os.path.exists(schemaFile):
+        return()
+    for fieldName in fieldNames:
+        fieldTypes.setdefault(fieldName, "str")
+    with open(schemaFile, "w") as f:
+        json.dump(dict(sorted(fieldTypes.items())), f, indent=2)
+    print('***', len(fieldTypes), "field types written to", schemaFile)
+    return()
+
+def readDdlSchema(ddlFile, opts):
+    '''
+    compile the RECORD= / FIELD= entries of a DMDDBE ddl, split in entries as ddlViewer.py does :
+    {"records": {recordName: [field...]}, "columns": [field...], "types": {field: "int"|"float"|"str"},
+    "multi": {field...}}, records and columns in ddl order, kept by --records and --fields, a field
+    of several record names has the type matching all of them
+    '''
+    try:
+        ddlSchema = ddlParser.compileDdlSchema(ddlParser.buildDdlItems(ddlParser.loadDdlLines(ddlFile)))
+    except Exception as e:
+        print("cannot read ddl", ddlFile)
+        print (str(e))
+        abnormalTermination()
+    recordNames = set(opts["records"].split(",")) if opts["records"] != "" else None
+    fieldNames = set(opts["fields"].split(",")) if opts["fields"] != "" else None
+    # fields added to the records by the K line key and the delta
+    firstColumns = [opts["keyName"]] if opts["keyName"] != "" else []
+    lastColumns = [changeFieldName] if opts["diff"] != "" else []
+    records, columns, kinds, multi = {}, {}, {}, set()
+    for recordName, fields in ddlSchema.items():
+        if recordNames is not None and recordName not in recordNames:
+            continue
+        records[recordName] = firstColumns.copy()
+        for fieldName, fieldType, isMulti in fields:
+            if fieldNames is not None and fieldName not in fieldNames:
+                continue
+            records[recordName].append(fieldName)
+            columns[fieldName] = True
+            kinds.setdefault(fieldName, set()).add(fieldType)
+            if isMulti:
+                multi.add(fieldName)
+        records[recordName] += lastColumns
+    if not columns:
+        print("no field in ddl", ddlFile, "for these --records / --fields")
         abnormalTermination()
-    print("{0:,} total lines".format(lineCount))
-    header = list(fieldCounts.keys())
-    header.sort()
-    print('***', len(header), "fields in header")
-    #print(header)
-    # must rewind input file
-    inF.seek(0)
+    types = {fieldName: getKindsType(fieldKinds) for fieldName, fieldKinds in kinds.items()}
+    print('***', len(records), "records,", len(columns), "fields,", len(multi), "with multiple occurences from", ddlFile)
+    return({"records": records, "columns": firstColumns + list(columns) + lastColumns, "types": types, "multi": multi})
+
+def getFieldTypes(opts):
+    # field types of --typing=field : from the --ddl schema, else from the --schema cache
+    if opts.get("ddlSchema") is not None:
+        return(dict(opts["ddlSchema"]["types"]))
+    return(readSchema(opts["schema"]))
+
+def getDdlHeader(opts, recordName=None):
+    # csv header / columns from the --ddl schema, of one record name if given, None without --ddl
+    if opts.get("ddlSchema") is None:
+        return(None)
+    if recordName is None:
+        return(opts["ddlSchema"]["columns"])
+    return(opts["ddlSchema"]["records"].get(recordName, []))
+
+def listDdlMulti(records, multiFields):
+    # fields with multiple occurences in the ddl are lists, also with a single value in the dump
+    for recordName, fieldsDict in records:
+        for fieldName, v in fieldsDict.items():
+            if fieldName in multiFields and type(v) != list:
+                fieldsDict[fieldName] = [v]
+        yield(recordName, fieldsDict)
+
+def getRecords(inFile, inF, encoding, fieldNames, opts, ranges=None, fieldTypes=None, progress=metrics):
+    # records of the input file, or of its byte ranges, with the engine, typing and filter options,
+    # the position of the bytes engine goes to progress (the run metrics, None for another input)
+    isTyped = opts["typing"] == "value"
+    recordFilter = getRecordFilter(opts)
+    keyName = opts["keyName"] if opts.get("keyName", "") != "" else None
+    longText = LongText(opts["textDir"], opts["textLimit"]) if opts.get("textDir", "") != "" else None
+    if ranges is None:
+        records = iterRecords(inF, encoding, fieldNames, opts["engine"], isTyped, recordFilter, keyName, longText,
+            progress)
+    else:
+        records = iterRangeRecords(inFile, encoding, fieldNames, opts["engine"], ranges, isTyped, recordFilter,
+            keyName, longText, progress)
+    records = metrics.timed(records, "parse")
+    if opts.get("ddlSchema") is not None:
+        records = listDdlMulti(records, opts["ddlSchema"]["multi"])
+    if opts["typing"] == "field":
+        records = metrics.timed(typeRecordsByField(records, fieldTypes, opts["typeSample"]), "typing")
+    return(records)
+
+def readFieldList(fieldListFile, encoding):
+    # read cached csv header, one field name per line
+    try:
+        with open(fieldListFile, "r", encoding=encoding) as f:
+            header = [l.strip() for l in f if l.strip() != ""]
+    except Exception as e:
+        print("cannot read field list", fieldListFile)
+        print (str(e))
+        abnormalTermination()
+    print('***', len(header), "fields in header from", fieldListFile)
     return(header)
 
-def doHvuToJson(inF, outF):
-    recordCount = 0
-    recordName = ""
-    outF.write("{\n\"RECORDS\" : [\n")
+def writeFieldList(fieldListFile, header, encoding):
+    # save csv header for the next conversions of the same view
+    with open(fieldListFile, "w", encoding=encoding) as f:
+        for fieldName in header:
+            f.write(fieldName + "\n")
+    print('***', len(header), "fields written to", fieldListFile)
+    return()
+
+def openSpillFile(tempDir):
+    # binary temporary file, removed when closed
+    try:
+        spillF = tempfile.TemporaryFile(dir=tempDir if tempDir != "" else None)
+    except Exception as e:
+        print("cannot open spill file")
+        print (str(e))
+        abnormalTermination()
+    return(spillF)
+
+def readSpillFile(spillF):
+    # return spilled records in their original order
+    spillF.seek(0)
     while True:
+        try:
+            yield pickle.load(spillF)
+        except EOFError:
+            return
+
+def writeJsonRecords(records, outF, isFirst=True, trace=True):
+    # write json records separated by commas, a leading comma unless isFirst, return the count of records
+    recordCount = 0
+    for recordName, fieldsDict in records:
         recordCount +=1
-        if recordCount % traceEvery == 0:
-            print("{0:,} records".format(recordCount))
-        recordName, recordDict, isLastRecord = getRecordDictionary(inF, recordCount, recordName)
-        recordJson = json.dumps(recordDict, indent=2, sort_keys=True)
+        if trace and recordCount % traceEvery == 0:
+            metrics.progress(recordCount)
+        recordJson = json.dumps({recordName: fieldsDict}, indent=2, sort_keys=True)
         #print(recordJson)
-        if recordCount > 1:
+        if recordCount > 1 or not isFirst:
             outF.write(",\n")
         outF.write(recordJson)
         #json.dump(recordDict, outF, indent=2, sort_keys=True)
-        if isLastRecord:
-            print("{0:,} total records".format(recordCount))
-            break
+    return(recordCount)
+
+def writeJsonHeader(outF):
+    outF.write("{\n\"RECORDS\" : [\n")
+    return()
+
+def writeJsonFooter(outF, recordCount):
     outF.write("\n],\n\"RECORDS_COUNT\" : %d\n}\n" % recordCount)
     return()
 
-def doHvuToXml(inF, outF):
+def doHvuToJson(records, outF):
+    writeJsonHeader(outF)
+    recordCount = writeJsonRecords(records, outF)
+    print("{0:,} total records".format(recordCount))
+    writeJsonFooter(outF, recordCount)
+    return()
+
+def getJsonText(obj):
+    # compact json, orjson if installed, json for what orjson refuses (> 64 bits ints)
+    if orjson is not None:
+        try:
+            return(orjson.dumps(obj, option=orjson.OPT_SORT_KEYS).decode("utf-8"))
+        except orjson.JSONEncodeError:
+            pass
+    return(json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True))
+
+def getJsonLine(recordName, fieldsDict):
+    # compact {"NAME": {fields}} line
+    return(getJsonText({recordName: fieldsDict}))
+
+def writeJsonlRecords(records, outF, trace=True):
+    # write one json record per line, writeBatchSize lines at once, return the count of records
     recordCount = 0
-    recordName = ""
+    lines = []
+    for recordName, fieldsDict in records:
+        recordCount +=1
+        if trace and recordCount % traceEvery == 0:
+            metrics.progress(recordCount)
+        lines.append(getJsonLine(recordName, fieldsDict))
+        if len(lines) == writeBatchSize:
+            lines.append("")
+            outF.write("\n".join(lines))
+            lines = []
+    if lines:
+        lines.append("")
+        outF.write("\n".join(lines))
+    return(recordCount)
+
+def doHvuToJsonl(records, outF):
+    recordCount = writeJsonlRecords(records, outF)
+    print("{0:,} total records".format(recordCount))
+    return()
+
+def escapeXml(v):
+    # element text as written by xml.sax.saxutils.escape
+    v = str(v)
+    if "&" in v:
+        v = v.replace("&", "&amp;")
+    if "<" in v:
+        v = v.replace("<", "&lt;")
+    if ">" in v:
+        v = v.replace(">", "&gt;")
+    return(v)
+
+def checkXmlName(name):
+    # element names are checked once, as xmltodict did
+    if name not in xmlCheckedNames:
+        if name == "" or "<" in name or ">" in name or "/" in name or any(c.isspace() for c in name):
+            raise ValueError("invalid xml element name: " + repr(name))
+        xmlCheckedNames.add(name)
+    return()
+
+def getXmlRecord(recordName, fieldsDict, isPretty=True):
+    '''
+    <NAME> element with one child per field value, multi occurrence fields repeated,
+    pretty is the layout of xmltodict.unparse(pretty=True, newl="\\n", indent="  ")
+    '''
+    sep, indent = ("\n", "  ") if isPretty and fieldsDict else ("", "")
+    checkXmlName(recordName)
+    parts = ["\n<", recordName, ">", sep]
+    for fieldName, v in fieldsDict.items():
+        checkXmlName(fieldName)
+        for x in (v if type(v) == list else (v,)):
+            parts += (indent, "<", fieldName, ">", escapeXml(x), "</", fieldName, ">", sep)
+    parts += ("</", recordName, ">")
+    return("".join(parts))
+
+def writeXmlRecords(records, outF, trace=True, isPretty=True):
+    # write xml records, each one on a new line, writeBatchSize records at once, return the count of records
+    recordCount = 0
+    parts = []
+    for recordName, fieldsDict in records:
+        recordCount +=1
+        if trace and recordCount % traceEvery == 0:
+            metrics.progress(recordCount)
+        parts.append(getXmlRecord(recordName, fieldsDict, isPretty))
+        if len(parts) == writeBatchSize:
+            outF.write("".join(parts))
+            parts = []
+    outF.write("".join(parts))
+    return(recordCount)
+
+def writeXmlHeader(outF):
     outF.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>")
     outF.write("\n<RECORDS>")
-    while True:
-        recordCount +=1
-        if recordCount % traceEvery == 0:
-            print("{0:,} records".format(recordCount))
-        recordName, recordDict, isLastRecord = getRecordDictionary(inF, recordCount, recordName)
-        #recordXml = xmltodict.unparse(recordDict, pretty=True, full_document=True, newl="\n", indent="  ")
-        #print(recordXml)
-        outF.write("\n")
-        xmltodict.unparse(recordDict, output=outF, pretty=True, full_document=False, newl="\n", indent="  ")
-        if isLastRecord:
-            print("{0:,} total records".format(recordCount))
-            break
+    return()
+
+def writeXmlFooter(outF, recordCount):
     outF.write("\n</RECORDS>")
     outF.write("\n<RECORDS_COUNT>%d</RECORDS_COUNT>\n" % recordCount)
     return()
 
-def doHvuToCsv(inF, outF, encoding):
-    recordCount = 0
-    recordName = ""
-    # get header by reading whole file in and rewind it
-    header = getFieldList(inF, encoding)
-    # csv writer
+def doHvuToXml(records, outF, isPretty=True):
+    writeXmlHeader(outF)
+    recordCount = writeXmlRecords(records, outF, isPretty=isPretty)
+    print("{0:,} total records".format(recordCount))
+    writeXmlFooter(outF, recordCount)
+    return()
+
+def getCsvWriter(outF, header, writeHeader=True):
     csv.register_dialect('xyz', delimiter=csvColDelimiter, quoting=csv.QUOTE_NONE,
         escapechar='\\', quotechar='\'')
     writer = csv.DictWriter(outF, fieldnames=header, dialect='xyz')
-    writer.writeheader()
-    while True:
+    if writeHeader:
+        writer.writeheader()
+    return(writer)
+
+def stopDdlMissing(recordCount):
+    # a record has fields not declared in the --ddl schema, csv and columnar outputs stop
+    print("record", recordCount, "has fields missing in the --ddl schema")
+    print("drop them with --fields or add them to the ddl")
+    abnormalTermination()
+    return()
+
+def writeCsvRow(writer, noTitleRecordDict, recordCount, fieldListFile, isDdl=False):
+    try:
+        writer.writerow(noTitleRecordDict)
+    except csv.Error:
+        # QUOTE_NONE cannot write a single empty field, it is an empty line
+        writer.writer.writerow([])
+    except ValueError:
+        if isDdl:
+            stopDdlMissing(recordCount)
+        else:
+            print("record", recordCount, "has fields missing in", fieldListFile)
+            print("remove the field list to rebuild it")
+        abnormalTermination()
+    return()
+
+def spillRecords(records, spillF, trace=True):
+    # pickle the records to the spill file, return the count of records
+    recordCount = 0
+    for recordName, fieldsDict in records:
+        recordCount +=1
+        if trace and recordCount % traceEvery == 0:
+            metrics.progress(recordCount)
+        pickle.dump(fieldsDict, spillF, pickle.HIGHEST_PROTOCOL)
+    return(recordCount)
+
+def writeCsvFromSpills(outF, spillFiles, fieldNames, encoding, fieldListFile="", ddlHeader=None):
+    # write header then the spilled rows, save or check the cached field list, the --ddl header is checked only
+    isCached = fieldListFile != "" and os.path.exists(fieldListFile)
+    if ddlHeader is not None:
+        header = ddlHeader
+    elif isCached:
+        header = readFieldList(fieldListFile, encoding)
+    else:
+        header = sorted(fieldNames)
+        print('***', len(header), "fields in header")
+    writer = getCsvWriter(outF, header)
+    recordCount = 0
+    for spillF in spillFiles:
+        for noTitleRecordDict in readSpillFile(spillF):
+            recordCount += 1
+            writeCsvRow(writer, noTitleRecordDict, recordCount, fieldListFile, ddlHeader is not None)
+    if fieldListFile != "" and not isCached and ddlHeader is None:
+        writeFieldList(fieldListFile, header, encoding)
+    return()
+
+def doHvuToCsv(records, outF, fieldNames, encoding, fieldListFile="", tempDir="", ddlHeader=None):
+    # fieldNames is the set filled by the records iterator
+    recordCount = 0
+    # header is known beforehand from the --ddl schema or when cached, else the rows
+    # are spilled while the fields are collected, the dump is read only once
+    if ddlHeader is not None or (fieldListFile != "" and os.path.exists(fieldListFile)):
+        header = ddlHeader if ddlHeader is not None else readFieldList(fieldListFile, encoding)
+        writer = getCsvWriter(outF, header)
+        for recordName, fieldsDict in records:
+            recordCount +=1
+            if recordCount % traceEvery == 0:
+                metrics.progress(recordCount)
+            writeCsvRow(writer, fieldsDict, recordCount, fieldListFile, ddlHeader is not None)
+    else:
+        if tempDir == "":
+            tempDir = os.path.dirname(os.path.abspath(outF.name))
+        spillF = openSpillFile(tempDir)
+        recordCount = spillRecords(records, spillF)
+        writeCsvFromSpills(outF, [spillF], fieldNames, encoding, fieldListFile)
+        spillF.close()
+    print("{0:,} total records".format(recordCount))
+    return()
+
+########## columnar output ##########
+
+def spillTypedRecords(records, spillF, fieldTypes, listFields):
+    # pickle the records to the spill file, collect for each field the python
+    # types given by setValueType and whether it has multiple occurences
+    recordCount = 0
+    for recordName, fieldsDict in records:
         recordCount +=1
         if recordCount % traceEvery == 0:
-            print("{0:,} records".format(recordCount))
-        recordName, recordDict, isLastRecord = getRecordDictionary(inF, recordCount, recordName)
-        noTitleRecordDict = recordDict[recordName]
-        writer.writerow(noTitleRecordDict)
-        if isLastRecord:
-            print("{0:,} total records".format(recordCount))
-            break
+            metrics.progress(recordCount)
+        for fieldName, v in fieldsDict.items():
+            types = fieldTypes.setdefault(fieldName, set())
+            if type(v) == list:
+                listFields.add(fieldName)
+                for x in v:
+                    types.add(getArrowValueType(x))
+            else:
+                types.add(getArrowValueType(v))
+        pickle.dump(fieldsDict, spillF, pickle.HIGHEST_PROTOCOL)
+    return(recordCount)
+
+def getArrowValueType(v):
+    # integers out of int64 range are kept as strings
+    if type(v) == int and not -2**63 <= v < 2**63:
+        return(str)
+    return(type(v))
+
+def getArrowSchema(fieldTypes, listFields, columns=None):
+    # int only : int64, int and float : float64, else string, fields with multiple
+    # occurences are lists of that type, columns sorted by name unless given
+    fields = []
+    for fieldName in (columns if columns is not None else sorted(fieldTypes.keys())):
+        types = fieldTypes[fieldName]
+        if types == {int}:
+            t = pa.int64()
+        elif types <= {int, float}:
+            t = pa.float64()
+        else:
+            t = pa.string()
+        if fieldName in listFields:
+            t = pa.list_(t)
+        fields.append(pa.field(fieldName, t))
+    return(pa.schema(fields))
+
+def getDdlArrowSchema(opts, recordName=None):
+    # columns of the --ddl schema (of one record name if given) typed as the records, None without --ddl
+    header = getDdlHeader(opts, recordName)
+    if header is None or pa is None:
+        return(None)
+    pythonTypes = {"int": {int}, "float": {float}, "str": {str}}
+    types = opts["ddlSchema"]["types"] if opts["typing"] == "field" else {}
+    fieldTypes = {fieldName: pythonTypes[types.get(fieldName, "str")] for fieldName in header}
+    return(getArrowSchema(fieldTypes, opts["ddlSchema"]["multi"], header))
+
+def getArrowColumns(rows, schema):
+    # build column lists for a batch of rows, values cast to the column type
+    columns = {}
+    for field in schema:
+        t = field.type.value_type if pa.types.is_list(field.type) else field.type
+        cast = str if pa.types.is_string(t) else float if pa.types.is_floating(t) else None
+        values = [row.get(field.name) for row in rows]
+        if pa.types.is_list(field.type):
+            values = [v if v is None or type(v) == list else [v] for v in values]
+            if cast is not None:
+                values = [v if v is None else [cast(x) for x in v] for v in values]
+        elif cast is not None:
+            values = [v if v is None else cast(v) for v in values]
+        columns[field.name] = values
+    return(columns)
+
+def doHvuToArrow(records, outF, action, tempDir="", batchSize=arrowBatchSize, ddlSchema=None):
+    # toParquet / toArrow : rows are spilled while the column types are found, or streamed
+    # with the --ddl schema, then written in batches of batchSize rows (one parquet row group each)
+    if pa is None:
+        print("action", action, "needs pyarrow : pip install pyarrow")
+        abnormalTermination()
+    spillF = None
+    if ddlSchema is not None:
+        schema = ddlSchema
+        recordCount = 0
+        rowRecords = (fieldsDict for recordName, fieldsDict in records)
+        columnNames = set(schema.names)
+        print('***', len(schema), "columns from the ddl")
+    else:
+        if tempDir == "":
+            tempDir = os.path.dirname(os.path.abspath(outF.name))
+        spillF = openSpillFile(tempDir)
+        fieldTypes, listFields = {}, set()
+        recordCount = spillTypedRecords(records, spillF, fieldTypes, listFields)
+        try:
+            schema = getArrowSchema(fieldTypes, listFields)
+        except Exception as e:
+            print("cannot build column schema")
+            print (str(e))
+            abnormalTermination()
+        print('***', len(schema), "columns,", len(listFields), "with multiple occurences")
+        rowRecords = readSpillFile(spillF)
+    if action == "toParquet":
+        writer = pq.ParquetWriter(outF, schema)
+    else:
+        writer = pa.ipc.new_file(outF, schema)
+    rows = []
+    for row in itertools.chain(rowRecords, [None]):
+        if row is not None:
+            rows.append(row)
+            if spillF is None:
+                recordCount += 1
+                if recordCount % traceEvery == 0:
+                    metrics.progress(recordCount)
+                if not columnNames.issuperset(row):
+                    stopDdlMissing(recordCount)
+        if len(rows) == batchSize or (row is None and rows):
+            try:
+                batch = pa.RecordBatch.from_pydict(getArrowColumns(rows, schema), schema=schema)
+            except (pa.ArrowException, TypeError, ValueError) as e:
+                print("values not matching their column type, use --typing=none")
+                print (str(e))
+                abnormalTermination()
+            writer.write_batch(batch)
+            rows = []
+    writer.close()
+    if spillF is not None:
+        spillF.close()
+    print("{0:,} total records".format(recordCount))
+    return()
+
+########## relational output ##########
+
+def spillTableRecords(records, spillF, tables):
+    # pickle (recordName, fieldsDict) to the spill file, collect per record type the
+    # python types of each field and the fields with multiple occurences
+    recordCount = 0
+    for recordName, fieldsDict in records:
+        recordCount +=1
+        if recordCount % traceEvery == 0:
+            metrics.progress(recordCount)
+        fieldTypes, listFields = tables.setdefault(recordName, ({}, set()))
+        for fieldName, v in fieldsDict.items():
+            types = fieldTypes.setdefault(fieldName, set())
+            if type(v) == list:
+                listFields.add(fieldName)
+                for x in v:
+                    types.add(getArrowValueType(x))
+            else:
+                types.add(getArrowValueType(v))
+        pickle.dump((recordName, fieldsDict), spillF, pickle.HIGHEST_PROTOCOL)
+    return(recordCount)
+
+def getSqlName(name):
+    # lower case identifier, other characters than letters, digits and _ replaced by _
+    return(re.sub(r"\W", "_", name).lower())
+
+def getSqlTables(tables, dialect):
+    '''
+    one table per record type : record_id (number of the record in the output) and one
+    column per single occurence field, one child table (record_id, occ, value) per field
+    with multiple occurences, column types as for parquet (integer, float or text)
+    '''
+    sqlTypes = sqlDialectTypes[dialect]
+    tableDefs = {}
+    for recordName in sorted(tables):
+        fieldTypes, listFields = tables[recordName]
+        tableName = getSqlName(recordName)
+        columns, children = [], []
+        for fieldName in sorted(fieldTypes):
+            types = fieldTypes[fieldName]
+            if types == {int}:
+                sqlType, cast = sqlTypes[0], None
+            elif types <= {int, float}:
+                sqlType, cast = sqlTypes[1], float
+            else:
+                sqlType, cast = sqlTypes[2], str
+            if fieldName in listFields:
+                children.append((fieldName, tableName + "_" + getSqlName(fieldName), sqlType, cast))
+            else:
+                columns.append((fieldName, getSqlName(fieldName), sqlType, cast))
+        tableDefs[recordName] = (tableName, columns, children)
+    return(tableDefs)
+
+def getSqlDdl(tableDefs, dialect):
+    # create table statements, children after their parent table
+    idType = sqlDialectTypes[dialect][0]
+    statements = []
+    for tableName, columns, children in tableDefs.values():
+        columnDefs = ['"record_id" %s PRIMARY KEY' % idType] + ['"%s" %s' % (c[1], c[2]) for c in columns]
+        statements.append('CREATE TABLE "%s" (\n  %s\n)' % (tableName, ",\n  ".join(columnDefs)))
+        for fieldName, childName, sqlType, cast in children:
+            statements.append('CREATE TABLE "%s" (\n  "record_id" %s NOT NULL REFERENCES "%s",\n'
+                '  "occ" integer NOT NULL,\n  "value" %s,\n  PRIMARY KEY ("record_id", "occ")\n)'
+                % (childName, idType, tableName, sqlType))
+    return(statements)
+
+def iterSqlRows(spillF, tableDefs):
+    # (tableName, row) of the spilled records, parent row before its child rows
+    recordId = 0
+    for recordName, fieldsDict in readSpillFile(spillF):
+        recordId += 1
+        tableName, columns, children = tableDefs[recordName]
+        row = [recordId]
+        for fieldName, columnName, sqlType, cast in columns:
+            v = fieldsDict.get(fieldName)
+            row.append(v if v is None or cast is None else cast(v))
+        yield(tableName, row)
+        for fieldName, childName, sqlType, cast in children:
+            v = fieldsDict.get(fieldName)
+            if v is None:
+                continue
+            for occ, x in enumerate(v if type(v) == list else [v], 1):
+                yield(childName, (recordId, occ, x if cast is None else cast(x)))
+
+def doHvuToSqlite(records, outFile, tempDir="", batchSize=sqlBatchSize):
+    # toSqlite : rows are spilled while the column types are found, then inserted
+    # with executemany in batches of batchSize rows, in one transaction
+    if tempDir == "":
+        tempDir = os.path.dirname(os.path.abspath(outFile))
+    spillF = openSpillFile(tempDir)
+    tables = {}
+    recordCount = spillTableRecords(records, spillF, tables)
+    tableDefs = getSqlTables(tables, "sqlite")
+    if os.path.exists(outFile):
+        os.remove(outFile)
+    conn = sqlite3.connect(outFile)
+    # the database is rebuilt from the dump if the load fails
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    inserts = {}
+    for tableName, columns, children in tableDefs.values():
+        inserts[tableName] = 'INSERT INTO "%s" VALUES (%s)' % (tableName, ", ".join("?" * (len(columns) + 1)))
+        for child in children:
+            inserts[child[1]] = 'INSERT INTO "%s" VALUES (?, ?, ?)' % child[1]
+    with conn:
+        for statement in getSqlDdl(tableDefs, "sqlite"):
+            conn.execute(statement)
+        batches = {tableName: [] for tableName in inserts}
+        for tableName, row in iterSqlRows(spillF, tableDefs):
+            batch = batches[tableName]
+            batch.append(row)
+            if len(batch) == batchSize:
+                conn.executemany(inserts[tableName], batch)
+                batch.clear()
+        for tableName, batch in batches.items():
+            if batch:
+                conn.executemany(inserts[tableName], batch)
+    conn.close()
+    spillF.close()
+    print('***', len(inserts), "tables written to", outFile)
+    print("{0:,} total records".format(recordCount))
+    return()
+
+def getCopyText(v):
+    # postgresql copy text format : \N for null, backslash escapes
+    if v is None:
+        return("\\N")
+    s = str(v)
+    if "\\" in s or "\t" in s or "\n" in s or "\r" in s:
+        s = s.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return(s)
+
+def doHvuToPgCopy(records, outDir, tempDir=""):
+    # toPgCopy : outDir gets schema.sql (ddl), one table.copy file per table (copy text
+    # format, UTF-8) and load.sql, to run with "psql -f load.sql" from outDir
+    os.makedirs(outDir, exist_ok=True)
+    if tempDir == "":
+        tempDir = outDir
+    spillF = openSpillFile(tempDir)
+    tables = {}
+    recordCount = spillTableRecords(records, spillF, tables)
+    tableDefs = getSqlTables(tables, "postgresql")
+    with open(os.path.join(outDir, "schema.sql"), "w", encoding="UTF-8") as f:
+        for statement in getSqlDdl(tableDefs, "postgresql"):
+            f.write(statement + ";\n\n")
+    copyFiles = {}
+    for tableName, columns, children in tableDefs.values():
+        for name in [tableName] + [child[1] for child in children]:
+            copyFiles[name] = open(os.path.join(outDir, name + ".copy"), "w", encoding="UTF-8", newline="\n")
+    for tableName, row in iterSqlRows(spillF, tableDefs):
+        copyFiles[tableName].write("\t".join([getCopyText(v) for v in row]) + "\n")
+    for copyF in copyFiles.values():
+        copyF.close()
+    with open(os.path.join(outDir, "load.sql"), "w", encoding="UTF-8") as f:
+        f.write("\\set ON_ERROR_STOP on\nBEGIN;\n\\i schema.sql\n")
+        for name in copyFiles:
+            f.write("\\copy \"%s\" FROM '%s.copy' WITH (FORMAT text, ENCODING 'UTF8')\n" % (name, name))
+        f.write("COMMIT;\n")
+    spillF.close()
+    print('***', len(copyFiles), "tables written to", outDir)
+    print("{0:,} total records".format(recordCount))
+    return()
+
+########## bulk output ##########
+
+def getRecordKey(fieldsDict, keyId):
+    # the K line key (kept under keyFieldName by the parser) or the first occurence of field keyId, as text
+    v = fieldsDict.get(keyFieldName if keyId == "K" else keyId)
+    if type(v) == list:
+        v = v[0] if v else None
+    return(None if v is None else str(v))
+
+def getBulkLines(recordName, fieldsDict, opts):
+    '''
+    elasticsearch / opensearch : {"index": {"_index": ..., "_id": ...}} action line and source line,
+    index from --bulkindex or the record name in lower case, no _id without key (generated),
+    a record deleted by --diff is a {"delete": ...} action line alone, "" without _id
+    solr : one document line with its "id", for the /update/json/docs handler
+    '''
+    docId = getRecordKey(fieldsDict, opts["bulkId"])
+    fieldsDict.pop(keyFieldName, None)
+    if fieldsDict.get(changeFieldName) == "delete":
+        if docId is None:
+            return("")
+        index = opts["bulkIndex"] if opts["bulkIndex"] != "" else recordName.lower()
+        return(getJsonText({"delete": {"_index": index, "_id": docId}}) + "\n")
+    if opts["bulk"] == "solr":
+        if docId is not None:
+            fieldsDict = dict(fieldsDict, id=docId)
+        return(getJsonText(fieldsDict) + "\n")
+    action = {"_index": opts["bulkIndex"] if opts["bulkIndex"] != "" else recordName.lower()}
+    if docId is not None:
+        action["_id"] = docId
+    return(getJsonText({"index": action}) + "\n" + getJsonText(fieldsDict) + "\n")
+
+def checkBulkUrl(url):
+    # --bulkurl must be http(s)://host..., checked before any bulk file is written
+    try:
+        parts = urllib.parse.urlsplit(url)
+        isValid = parts.scheme in ("http", "https") and parts.hostname is not None
+    except ValueError:
+        isValid = False
+    if not isValid:
+        print("invalid --bulkurl", url, "expected http://host:port/path")
+        abnormalTermination()
+    return()
+
+def getNumberedFileName(outFile, number, defaultExt=""):
+    # out.ndjson -> out_000001.ndjson, out.json.gz -> out_000001.json.gz
+    base, ext = os.path.splitext(outFile)
+    compressExt = ""
+    if ext[1:] in compressMagic:
+        base, ext, compressExt = os.path.splitext(base) + (ext,)
+    return("%s_%06d%s%s" % (base, number, ext if ext != "" else defaultExt, compressExt))
+
+def getBulkErrors(body):
+    # ([positions of the items rejected for load], items failed) of an elasticsearch bulk response, none for solr
+    try:
+        response = json.loads(body)
+    except ValueError:
+        return([], 0)
+    if not isinstance(response, dict) or not response.get("errors"):
+        return([], 0)
+    rejected = []
+    failed = 0
+    for i, item in enumerate(response.get("items", [])):
+        status = next(iter(item.values()), {}).get("status", 200)
+        if status == 429:
+            rejected.append(i)
+        elif status >= 300:
+            failed += 1
+    return(rejected, failed)
+
+def compressBulkData(data, compression):
+    # body of a bulk request, compressed as the bulk files
+    if compression == "gz":
+        return(gzip.compress(data, gzipLevel))
+    if compression == "zst":
+        return(zstandard.ZstdCompressor(level=zstdLevel).compress(data))
+    return(data)
+
+def getBulkRetryData(data, rejected):
+    # the action and source lines of the rejected items only, the other ones are indexed,
+    # a delete action has no source line
+    items = []
+    lines = iter(data.splitlines(True))
+    for line in lines:
+        if "delete" in json.loads(line):
+            items.append(line)
+        else:
+            items.append(line + next(lines))
+    return(b"".join(items[i] for i in rejected))
+
+class BulkSender:
+    '''
+    posts the bulk files to url from senders threads, send() blocks while senders files
+    are waiting (backpressure on the conversion), a file is sent again after a network
+    error or http 429 / 5xx, only its rejected items after a partial rejection, up to
+    bulkRetries times with a doubling delay, compressed files are sent with their Content-Encoding
+    '''
+    def __init__(self, url, contentType, senders=2, retries=bulkRetries, compression=""):
+        self.url = url
+        self.headers = {"Content-Type": contentType}
+        self.compression = compression
+        if compression != "":
+            self.headers["Content-Encoding"] = bulkContentEncodings[compression]
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=senders)
+        self.lock = threading.Lock()
+        self.sentCount = self.failedItems = 0
+        self.failedFiles = []
+        self.threads = [threading.Thread(target=self.run, daemon=True) for i in range(senders)]
+        for thread in self.threads:
+            thread.start()
+
+    def send(self, fileName):
+        self.queue.put(fileName)
+
+    def run(self):
+        # a sender thread stays alive whatever the error, the queue is always drained
+        while (fileName := self.queue.get()) is not None:
+            try:
+                self.post(fileName)
+            except Exception as e:
+                print("cannot send", fileName, str(e))
+                with self.lock:
+                    self.failedFiles.append(fileName)
+
+    def post(self, fileName):
+        with open(fileName, "rb") as f:
+            body = f.read()
+        # uncompressed lines, read for a partial retry
+        data = body if self.compression == "" else None
+        error = ""
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(bulkRetryDelay * 2 ** (attempt - 1))
+            request = urllib.request.Request(self.url, data=body, method="POST", headers=self.headers)
+            try:
+                with urllib.request.urlopen(request, timeout=bulkTimeout) as response:
+                    responseBody = response.read()
+            except urllib.error.HTTPError as e:
+                error = "http %d %s" % (e.code, e.reason)
+                if e.code != 429 and e.code < 500:
+                    break
+                continue
+            except (urllib.error.URLError, OSError) as e:
+                error = str(e)
+                continue
+            rejected, failed = getBulkErrors(responseBody)
+            with self.lock:
+                self.failedItems += failed
+            if rejected:
+                # documents without _id would be indexed twice if the whole file was sent again
+                if data is None:
+                    with openCompressedFile(fileName, self.compression, "rb") as f:
+                        data = f.read()
+                data = getBulkRetryData(data, rejected)
+                body = compressBulkData(data, self.compression)
+                error = "%d items rejected" % len(rejected)
+                continue
+            with self.lock:
+                self.sentCount += 1
+            return()
+        print("cannot send", fileName, error)
+        with self.lock:
+            self.failedFiles.append(fileName)
+        return()
+
+    def close(self):
+        # wait for the files queued
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+def doHvuToBulk(records, outFile, opts):
+    # toBulk : _bulk ndjson files of about --bulksize MB, each one ending on a whole
+    # document, sent to --bulkurl once written if asked
+    sender = None
+    compression = getOutCompression(outFile, opts)
+    if opts["bulkUrl"] != "":
+        contentType = "application/json" if opts["bulk"] == "solr" else "application/x-ndjson"
+        sender = BulkSender(opts["bulkUrl"], contentType, opts["bulkSenders"], compression=compression)
+    maxBytes = int(opts["bulkSize"] * 1024 * 1024)
+    recordCount = fileCount = size = noIdCount = 0
+    outF = None
+    for recordName, fieldsDict in records:
+        recordCount +=1
+        if recordCount % traceEvery == 0:
+            metrics.progress(recordCount)
+        data = getBulkLines(recordName, fieldsDict, opts).encode("utf-8")
+        if data == b"":
+            # deleted record without document id
+            noIdCount += 1
+            continue
+        if outF is not None and size + len(data) > maxBytes:
+            outF.close()
+            if sender is not None:
+                sender.send(bulkFile)
+            outF = None
+        if outF is None:
+            fileCount += 1
+            bulkFile = getNumberedFileName(outFile, fileCount, ".ndjson")
+            outF = openOutFile(bulkFile, "UTF-8", True, compression)
+            size = 0
+        outF.write(data)
+        size += len(data)
+    if outF is not None:
+        outF.close()
+        if sender is not None:
+            sender.send(bulkFile)
+    print('***', fileCount, "bulk files written to", getNumberedFileName(outFile, 1, ".ndjson"), "...")
+    print("{0:,} total records".format(recordCount))
+    if noIdCount > 0:
+        print("*** {0:,} deleted records without document id not written, see --bulkid".format(noIdCount))
+    if sender is not None:
+        with metrics.phase("send"):
+            sender.close()
+        print("*** {0:,} bulk files sent to {1}, {2:,} failed items".format(sender.sentCount, opts["bulkUrl"],
+            sender.failedItems))
+        if sender.failedFiles:
+            print("***", len(sender.failedFiles), "bulk files not sent")
+            abnormalTermination()
+    return()
+
+########## output shards ##########
+
+class ShardWriter:
+    # output file of a shard, counting the bytes written
+    def __init__(self, f, encoding):
+        self.f = f
+        self.size = 0
+        self.encoding = encoding
+        # one byte per character
+        self.isSingleByte = codecs.lookup(encoding).name in ("iso8859-1", "ascii", "cp1252")
+
+    def write(self, s):
+        self.size += len(s) if self.isSingleByte else len(s.encode(self.encoding, "replace"))
+        return self.f.write(s)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+def getSize(s):
+    # bytes of 500000, 512K, 100M or 2G
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if s[-1:].upper() in units:
+        return(int(float(s[:-1]) * units[s[-1:].upper()]))
+    return(int(s))
+
+def iterShardRecords(records, outF, opts, counts):
+    # records of the shared iterator until the shard has --shardrecords records or --shardbytes bytes,
+    # the writers join up to writeBatchSize records in one write, a shard can be that much larger
+    shardCount = 0
+    for record in records:
+        shardCount += 1
+        counts["records"] += 1
+        if counts["records"] % traceEvery == 0:
+            metrics.progress(counts["records"])
+        yield(record)
+        if (opts["shardRecords"] > 0 and shardCount >= opts["shardRecords"]) \
+            or (opts["shardBytes"] > 0 and outF.size >= opts["shardBytes"]):
+            return
+
+def doHvuToShards(records, outFile, action, encoding, fieldNames, opts):
+    '''
+    --shardrecords / --shardbytes : toJson, toJsonl, toXml, toCsv output in numbered shards,
+    each one a valid file of its own (json and xml with their records count, csv with the header),
+    listed with their records and bytes in the manifest out.manifest.json
+    '''
+    outEncoding = getOutEncoding(action, encoding)
+    compression = getOutCompression(outFile, opts)
+    ddlHeader = getDdlHeader(opts)
+    if action == "toCsv" and ddlHeader is not None:
+        header = ddlHeader
+        print('***', len(header), "fields in header from the ddl")
+    elif action == "toCsv":
+        # the header of every shard has all the fields, known once the records are spilled
+        tempDir = opts["tempDir"] if opts["tempDir"] != "" else os.path.dirname(os.path.abspath(outFile))
+        spillF = openSpillFile(tempDir)
+        spillRecords(records, spillF)
+        fieldListFile = opts["fieldList"]
+        if fieldListFile != "" and os.path.exists(fieldListFile):
+            header = readFieldList(fieldListFile, encoding)
+        else:
+            header = sorted(fieldNames)
+            if fieldListFile != "":
+                writeFieldList(fieldListFile, header, encoding)
+        print('***', len(header), "fields in header")
+        records = (("", fieldsDict) for fieldsDict in readSpillFile(spillF))
+    records = iter(records)
+    shards = []
+    counts = {"records": 0}
+    while (record := next(records, None)) is not None:
+        shardFile = getNumberedFileName(outFile, len(shards) + 1)
+        outF = ShardWriter(TimedWriter(openOutFile(shardFile, outEncoding, False, compression)), outEncoding)
+        shardRecords = iterShardRecords(itertools.chain([record], records), outF, opts, counts)
+        if action == "toJson":
+            writeJsonHeader(outF)
+            recordCount = writeJsonRecords(shardRecords, outF, trace=False)
+            writeJsonFooter(outF, recordCount)
+        elif action == "toJsonl":
+            recordCount = writeJsonlRecords(shardRecords, outF, trace=False)
+        elif action == "toXml":
+            writeXmlHeader(outF)
+            recordCount = writeXmlRecords(shardRecords, outF, trace=False, isPretty=opts["pretty"])
+            writeXmlFooter(outF, recordCount)
+        else:
+            writer = getCsvWriter(outF, header)
+            recordCount = 0
+            for recordName, fieldsDict in shardRecords:
+                recordCount += 1
+                writeCsvRow(writer, fieldsDict, counts["records"], opts["fieldList"], ddlHeader is not None)
+        outF.close()
+        shards.append({"file": os.path.basename(shardFile), "firstRecord": counts["records"] - recordCount + 1,
+            "records": recordCount, "bytes": os.path.getsize(shardFile)})
+    if action == "toCsv" and ddlHeader is None:
+        spillF.close()
+    manifestFile = getManifestFileName(outFile)
+    with open(manifestFile, "w") as f:
+        json.dump({"action": action, "encoding": outEncoding, "compression": compression, "records": counts["records"],
+            "shards": shards}, f, indent=2)
+    print('***', len(shards), "shards listed in", manifestFile)
+    print("{0:,} total records".format(counts["records"]))
+    return()
+
+def getManifestFileName(outFile):
+    # out.json -> out.manifest.json
+    base, ext = os.path.splitext(outFile)
+    if ext[1:] in compressMagic:
+        base = os.path.splitext(base)[0]
+    return(base + ".manifest.json")
+
+########## routing by record name ##########
+
+class RouteSpills:
+    # one pickle spill file per record name in a temporary directory, at most routeOpenFiles open at once
+    def __init__(self, tempDir):
+        self.dir = tempfile.mkdtemp(prefix="hvuroute", dir=tempDir if tempDir != "" else None)
+        self.files = {}
+        # open files, least recently written first
+        self.handles = {}
+
+    def write(self, recordName, fieldsDict):
+        f = self.handles.pop(recordName, None)
+        if f is None:
+            if len(self.handles) >= routeOpenFiles:
+                self.handles.pop(next(iter(self.handles))).close()
+            spillFile = self.files.setdefault(recordName, os.path.join(self.dir, "%d.spill" % len(self.files)))
+            f = open(spillFile, "ab")
+        self.handles[recordName] = f
+        pickle.dump(fieldsDict, f, pickle.HIGHEST_PROTOCOL)
+
+    def open(self, recordName):
+        # spill file of a record name, to read with readSpillFile
+        f = self.handles.pop(recordName, None)
+        if f is not None:
+            f.close()
+        return(open(self.files[recordName], "rb"))
+
+    def close(self):
+        for f in self.handles.values():
+            f.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def getRecordFileName(outFile, recordName):
+    # out.csv -> out_EMPLOYEE.csv, out.csv.gz -> out_EMPLOYEE.csv.gz
+    base, ext = os.path.splitext(outFile)
+    compressExt = ""
+    if ext[1:] in compressMagic:
+        base, ext, compressExt = os.path.splitext(base) + (ext,)
+    return("%s_%s%s%s" % (base, re.sub(r"[^\w.-]", "_", recordName), ext, compressExt))
+
+def doHvuByRecord(records, outFile, action, encoding, opts):
+    '''
+    --byrecord : each record name to its own output out_NAME.ext with its own fields,
+    the records are spilled by name in one pass over the input, then each output is
+    written in turn by the action
+    '''
+    spills = RouteSpills(opts["tempDir"])
+    fieldNames = {}
+    recordCount = 0
+    for recordName, fieldsDict in records:
+        recordCount +=1
+        if recordCount % traceEvery == 0:
+            metrics.progress(recordCount)
+        names = fieldNames.get(recordName)
+        if names is None:
+            names = fieldNames[recordName] = set()
+        names.update(fieldsDict)
+        spills.write(recordName, fieldsDict)
+    print("{0:,} total records".format(recordCount))
+    isBinary = action in ("toParquet", "toArrow")
+    for recordName in sorted(spills.files):
+        routeFile = getRecordFileName(outFile, recordName)
+        print("***", recordName, "to", routeFile)
+        outF = openOutFile(routeFile, getOutEncoding(action, encoding), isBinary, getOutCompression(outFile, opts))
+        if not isBinary:
+            outF = TimedWriter(outF)
+        spillF = spills.open(recordName)
+        if action == "toCsv":
+            writeCsvFromSpills(outF, [spillF], fieldNames[recordName], encoding, ddlHeader=getDdlHeader(opts, recordName))
+        else:
+            routeRecords = ((recordName, fieldsDict) for fieldsDict in readSpillFile(spillF))
+            if action == "toJson":
+                doHvuToJson(routeRecords, outF)
+            elif action == "toJsonl":
+                doHvuToJsonl(routeRecords, outF)
+            elif action == "toXml":
+                doHvuToXml(routeRecords, outF, opts["pretty"])
+            else:
+                doHvuToArrow(routeRecords, outF, action, opts["tempDir"], opts["rowGroup"],
+                    getDdlArrowSchema(opts, recordName))
+        spillF.close()
+        outF.close()
+    spills.close()
+    print('***', len(fieldNames), "record names, one output file each")
+    return()
+
+########## profile ##########
+
+class HyperLogLog:
+    # distinct count estimate in 2**p one byte registers, relative error about 1.04/sqrt(2**p)
+    def __init__(self, p=hllPrecision):
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(value.encode("UTF-8", "surrogatepass"), digest_size=8).digest(), "little")
+        i = h >> (64 - self.p)
+        rank = 65 - self.p - (h & ((1 << (64 - self.p)) - 1)).bit_length()
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        e = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # linear counting for small cardinalities
+        if e <= 2.5 * m and zeros > 0:
+            e = m * math.log(m / zeros)
+        return(round(e))
+
+class FieldProfile:
+    # bounded memory profile of the values of one field of one record type
+    def __init__(self):
+        self.recordCount = self.valueCount = self.emptyCount = 0
+        self.minLength = self.maxLength = None
+        self.minNumber = self.maxNumber = None
+        self.kinds = {}
+        self.occurrences = {}
+        self.distinct = HyperLogLog()
+        # top values (misra-gries) : counts are lower bounds, at most topError below the true counts
+        self.topCounts = {}
+        self.topError = 0
+
+    def add(self, v):
+        # v is the text value or the list of values of a record
+        values = v if type(v) == list else (v,)
+        self.recordCount += 1
+        self.occurrences[len(values)] = self.occurrences.get(len(values), 0) + 1
+        for x in values:
+            self.valueCount += 1
+            n = len(x)
+            if n == 0:
+                self.emptyCount += 1
+            if self.minLength is None or n < self.minLength:
+                self.minLength = n
+            if self.maxLength is None or n > self.maxLength:
+                self.maxLength = n
+            kind = getValueKind(x)
+            self.kinds[kind] = self.kinds.get(kind, 0) + 1
+            if kind != "str":
+                number = float(x) if kind == "float" else int(x)
+                if self.minNumber is None or number < self.minNumber:
+                    self.minNumber = number
+                if self.maxNumber is None or number > self.maxNumber:
+                    self.maxNumber = number
+            self.distinct.add(x)
+            if n > profileTopValueLength:
+                x = getTopValueKey(x)
+            self.topCounts[x] = self.topCounts.get(x, 0) + 1
+            if len(self.topCounts) > profileTopKCapacity:
+                self.pruneTopCounts()
+
+    def pruneTopCounts(self):
+        # every count decreased by the median count, the values down to 0 dropped (at least half),
+        # a count never loses more than the sum of the decrements kept in topError
+        decrement = sorted(self.topCounts.values())[len(self.topCounts) // 2]
+        self.topError += decrement
+        self.topCounts = {x: n - decrement for x, n in self.topCounts.items() if n > decrement}
+
+    def merge(self, other):
+        self.recordCount += other.recordCount
+        self.valueCount += other.valueCount
+        self.emptyCount += other.emptyCount
+        for a, f in (("minLength", min), ("maxLength", max), ("minNumber", min), ("maxNumber", max)):
+            values = [x for x in (getattr(self, a), getattr(other, a)) if x is not None]
+            setattr(self, a, f(values) if values else None)
+        for k, n in other.kinds.items():
+            self.kinds[k] = self.kinds.get(k, 0) + n
+        for k, n in other.occurrences.items():
+            self.occurrences[k] = self.occurrences.get(k, 0) + n
+        self.distinct.merge(other.distinct)
+        for x, n in other.topCounts.items():
+            self.topCounts[x] = self.topCounts.get(x, 0) + n
+        self.topError += other.topError
+        if len(self.topCounts) > profileTopKCapacity:
+            self.pruneTopCounts()
+
+    def toDict(self, typeRecordCount):
+        # json ready profile, nullRatio over the records of the record type
+        top = sorted(self.topCounts.items(), key=lambda item: (-item[1], item[0]))[:profileTopK]
+        kinds = {k: self.kinds[k] for k in sorted(self.kinds)}
+        return({"records": self.recordCount,
+            "nullRatio": round(1 - self.recordCount / typeRecordCount, 6) if typeRecordCount else 0,
+            "values": self.valueCount, "emptyValues": self.emptyCount,
+            "distinctEstimate": min(self.distinct.estimate(), self.valueCount),
+            "minLength": self.minLength, "maxLength": self.maxLength,
+            "minNumber": self.minNumber, "maxNumber": self.maxNumber,
+            "kinds": kinds, "inferredType": getKindsType(kinds),
+            "occurrences": {str(k): self.occurrences[k] for k in sorted(self.occurrences)},
+            "top": [{"value": x, "count": n} for x, n in top], "topCountError": self.topError})
+
+def getTopValueKey(x):
+    # long value cut to profileTopValueLength characters, a hash of the whole value keeps it distinct
+    digest = hashlib.blake2b(x.encode("UTF-8", "surrogatepass"), digest_size=4).hexdigest()
+    return(x[:profileTopValueLength] + "...#" + digest)
+
+def profileRecords(records, profiles=None, trace=True):
+    # add text records to profiles {recordName: [recordCount, {fieldName: FieldProfile}]}
+    if profiles is None:
+        profiles = {}
+    recordCount = 0
+    for recordName, fieldsDict in records:
+        recordCount += 1
+        if trace and recordCount % traceEvery == 0:
+            metrics.progress(recordCount)
+        recordProfile = profiles.get(recordName)
+        if recordProfile is None:
+            recordProfile = profiles[recordName] = [0, {}]
+        recordProfile[0] += 1
+        fieldProfiles = recordProfile[1]
+        for fieldName, v in fieldsDict.items():
+            fieldProfile = fieldProfiles.get(fieldName)
+            if fieldProfile is None:
+                fieldProfile = fieldProfiles[fieldName] = FieldProfile()
+            fieldProfile.add(v)
+    return(profiles)
+
+def getProfileDict(profiles):
+    # json ready profile of all record types and fields, sorted by name
+    recordTypes = {}
+    for recordName in sorted(profiles):
+        recordCount, fieldProfiles = profiles[recordName]
+        recordTypes[recordName] = {"records": recordCount,
+            "fields": {f: fieldProfiles[f].toDict(recordCount) for f in sorted(fieldProfiles)}}
+    return({"records": sum(p[0] for p in profiles.values()), "recordTypes": recordTypes})
+
+def printProfile(profileDict):
+    for recordName, recordType in profileDict["recordTypes"].items():
+        print("*** {0} [{1:,} records]".format(recordName, recordType["records"]))
+        for fieldName, p in recordType["fields"].items():
+            s = "{0} [{1:,}] null {2:.1%} distinct ~{3:,} length {4}..{5} {6}".format(fieldName,
+                p["records"], p["nullRatio"], p["distinctEstimate"], p["minLength"], p["maxLength"],
+                p["inferredType"])
+            if p["minNumber"] is not None:
+                s += " {0}..{1}".format(p["minNumber"], p["maxNumber"])
+            if len(p["occurrences"]) > 1 or "1" not in p["occurrences"]:
+                s += " occurrences " + ", ".join(k + ":" + str(n) for k, n in p["occurrences"].items())
+            print(s)
+            # top values only when some value repeats, long values cut
+            if p["top"] and p["top"][0]["count"] > 1:
+                print("    top", ", ".join("{0!r} ({1:,})".format(t["value"][:40], t["count"]) for t in p["top"]))
+    return()
+
+def writeProfileJson(profileDict, outFile, compression=""):
+    # profile json file, compressed as the other outputs
+    with openOutFile(outFile, "UTF-8", False, compression) as f:
+        json.dump(profileDict, f, indent=2, ensure_ascii=False)
+    return()
+
+def doProfile(records, outFile="", compression=""):
+    # one pass profile, printed, and written as json to outFile if given
+    profiles = profileRecords(records)
+    profileDict = getProfileDict(profiles)
+    printProfile(profileDict)
+    print("*** {0:,} records profiled".format(profileDict["records"]))
+    if outFile != "":
+        writeProfileJson(profileDict, outFile, compression)
+        print("*** profile written to", outFile)
+    return()
+
+def getSampleTotal(values, slotCount):
+    # estimated total over all slots of the sampled slot values, standard error
+    k = len(values)
+    mean = sum(values) / k
+    if k < 2:
+        return(slotCount * mean, None)
+    variance = sum((v - mean) ** 2 for v in values) / (k - 1)
+    return(slotCount * mean, slotCount * math.sqrt(variance / k * (1 - k / slotCount)))
+
+def getSampleRatio(ys, xs, slotCount):
+    # ratio estimate sum(ys) / sum(xs) of sampled slots, standard error
+    k, sumX = len(xs), sum(xs)
+    if sumX == 0:
+        return(0, None)
+    r = sum(ys) / sumX
+    if k < 2:
+        return(r, None)
+    residuals = sum((y - r * x) ** 2 for x, y in zip(xs, ys)) / (k - 1)
+    return(r, math.sqrt((1 - k / slotCount) * residuals / k) / (sumX / k))
+
+def getBounds(estimate, se, low=0, high=None):
+    # [estimate, low, high] with sampleZ standard errors, bounds None without error estimate
+    if se is None:
+        return([estimate, None, None])
+    lowBound, highBound = max(estimate - sampleZ * se, low), estimate + sampleZ * se
+    if high is not None:
+        highBound = min(highBound, high)
+    return([estimate, lowBound, highBound])
+
+def doSample(inFile, encoding, opts, outFile=""):
+    '''
+    estimated profile from about opts["sample"] records : the dump is cut in slots of
+    sampleWindowBytes, random slots are resynced to their first R line and parsed,
+    record and field counts are extrapolated with cluster sampling standard errors
+    '''
+    if "\n<<< record #".encode(encoding) != b"\n<<< record #":
+        print("encoding", encoding, "is not ascii based, sampling not possible")
+        abnormalTermination()
+    size = os.path.getsize(inFile)
+    slotCount = max(1, -(-size // sampleWindowBytes))
+    slots = random.Random(sampleSeed).sample(range(slotCount), slotCount)
+    profiles = {}
+    slotCounts = []
+    sampledCount = 0
+    # estimates are of the records kept by --fields / --records / --where
+    recordFilter = getRecordFilter(opts)
+
+    def countRecords(records, counts):
+        # count records per type and fields per record type of one slot
+        for recordName, fieldsDict in records:
+            counts[recordName] = counts.get(recordName, 0) + 1
+            for fieldName in fieldsDict:
+                counts[(recordName, fieldName)] = counts.get((recordName, fieldName), 0) + 1
+            yield(recordName, fieldsDict)
+
+    with open(inFile, "rb") as f:
+        for slot in slots:
+            start, end = slot * sampleWindowBytes, min((slot + 1) * sampleWindowBytes, size)
+            if start > 0:
+                start = findNextRecordStart(f, start, size)
+            if end < size:
+                end = findNextRecordStart(f, end, size)
+            counts = {}
+            if start < end:
+                records = iterRangeRecords(inFile, encoding, None, opts["engine"], [(start, end)], False,
+                    recordFilter)
+                profileRecords(countRecords(records, counts), profiles, trace=False)
+            slotCounts.append(counts)
+            sampledCount += sum(n for k, n in counts.items() if type(k) == str)
+            if sampledCount >= opts["sample"]:
+                break
+    print("*** {0:,} records sampled in {1:,} of {2:,} slots of {3:,} bytes".format(sampledCount,
+        len(slotCounts), slotCount, sampleWindowBytes))
+    profileDict = getProfileDict(profiles)
+    profileDict["sample"] = {"records": sampledCount, "slots": len(slotCounts), "slotCount": slotCount,
+        "slotBytes": sampleWindowBytes, "z": sampleZ}
+    for recordName, recordType in profileDict["recordTypes"].items():
+        xs = [counts.get(recordName, 0) for counts in slotCounts]
+        recordType["estimatedRecords"] = getBounds(*getSampleTotal(xs, slotCount))
+        for fieldName, p in recordType["fields"].items():
+            ys = [counts.get((recordName, fieldName), 0) for counts in slotCounts]
+            p["estimatedRecords"] = getBounds(*getSampleTotal(ys, slotCount))
+            p["presence"] = getBounds(*getSampleRatio(ys, xs, slotCount), high=1)
+    printSampleProfile(profileDict)
+    if outFile != "":
+        writeProfileJson(profileDict, outFile, getOutCompression(outFile, opts))
+        print("*** sampled profile written to", outFile)
+    return()
+
+def printSampleProfile(profileDict):
+    def formatBounds(bounds, format):
+        if bounds[1] is None:
+            return(format.format(bounds[0]))
+        return("{0} [{1}..{2}]".format(*(format.format(x) for x in bounds)))
+    for recordName, recordType in profileDict["recordTypes"].items():
+        print("*** {0} ~{1} records".format(recordName, formatBounds(recordType["estimatedRecords"], "{0:,.0f}")))
+        for fieldName, p in recordType["fields"].items():
+            print("{0} ~{1} present {2} {3} length {4}..{5} kinds {6}".format(fieldName,
+                formatBounds(p["estimatedRecords"], "{0:,.0f}"), formatBounds(p["presence"], "{0:.1%}"),
+                p["inferredType"], p["minLength"], p["maxLength"],
+                ", ".join(k + ":" + str(n) for k, n in p["kinds"].items())))
+    return()
+
+########## parallel conversion ##########
+
+class RangeReader(io.RawIOBase):
+    # raw binary stream limited to [start, end[ of a file
+    def __init__(self, inFile, start, end):
+        self.f = open(inFile, "rb")
+        self.f.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.remaining <= 0:
+            return 0
+        n = self.f.readinto(memoryview(b)[:min(len(b), self.remaining)])
+        self.remaining -= n
+        return n
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+def openRangeFile(inFile, encoding, start, end):
+    # text stream over a byte range, same newline handling as openInFile
+    return(io.TextIOWrapper(io.BufferedReader(RangeReader(inFile, start, end)), encoding=encoding))
+
+def findNextRecordStart(f, target, end):
+    # offset of the first "R  ...  <<< record # n >>>" line starting at or after
+    # target (> 0) in binary file f, end if there is none before end
+    # step back one byte, the partial line read includes the line feed
+    f.seek(target - 1)
+    f.readline()
+    while True:
+        pos = f.tell()
+        if pos >= end:
+            return(end)
+        line = f.readline()
+        if not line:
+            return(end)
+        if line.startswith(b"R") and b"<<< record #" in line:
+            return(pos)
+
+def findRecordBoundaries(inFile, encoding, workers, start=0, end=None):
+    # split input file, or its [start, end[ range, in byte ranges starting
+    # at "R  ...  <<< record # n >>>" lines
+    if "\n<<< record #".encode(encoding) != b"\n<<< record #":
+        print("encoding", encoding, "is not ascii based, parallel conversion not possible")
+        return([])
+    size = os.path.getsize(inFile) if end is None else end
+    starts = [start]
+    with open(inFile, "rb") as f:
+        for i in range(1, workers):
+            target = max(start + (size - start) * i // workers, starts[-1] + 1)
+            pos = findNextRecordStart(f, target, size)
+            if pos >= size:
+                break
+            starts.append(pos)
+    ranges = []
+    for i in range(len(starts)):
+        end = starts[i + 1] if i + 1 < len(starts) else size
+        ranges.append((starts[i], end))
+    return(ranges)
+
+def convertRange(job):
+    # worker : convert one byte range to a part file (json/xml, csv with the --ddl header) or spill file (csv)
+    inFile, encoding, start, end, action, outEncoding, tempDir, opts, fieldTypes = job
+    fd, partFile = tempfile.mkstemp(dir=tempDir)
+    os.close(fd)
+    fieldNames = set()
+    records = getRecords(inFile, None, encoding, fieldNames, opts, [(start, end)], fieldTypes)
+    ddlHeader = getDdlHeader(opts)
+    try:
+        if action == "toCsv" and ddlHeader is None:
+            with open(partFile, "wb") as partF:
+                recordCount = spillRecords(records, partF, trace=False)
+        else:
+            with open(partFile, "w", encoding=outEncoding) as partF:
+                if action == "toCsv":
+                    writer = getCsvWriter(partF, ddlHeader, False)
+                    recordCount = 0
+                    for recordName, fieldsDict in records:
+                        recordCount += 1
+                        writeCsvRow(writer, fieldsDict, recordCount, "", True)
+                elif action == "toJson":
+                    recordCount = writeJsonRecords(records, partF, trace=False)
+                elif action == "toJsonl":
+                    recordCount = writeJsonlRecords(records, partF, trace=False)
+                else:
+                    recordCount = writeXmlRecords(records, partF, False, opts["pretty"])
+    except BaseException:
+        os.remove(partFile)
+        raise
+    return(partFile, recordCount, fieldNames)
+
+def iterRangeRecords(inFile, encoding, fieldNames, engine, ranges, isTyped=True, recordFilter=None, keyName=None,
+    longText=None, progress=None):
+    # records of the given [start, end[ byte ranges of the input file
+    for start, end in ranges:
+        if engine == "bytes":
+            yield from iterRecordsBytes(inFile, encoding, fieldNames, start, end, isTyped, recordFilter, keyName,
+                longText, progress)
+        else:
+            with openRangeFile(inFile, encoding, start, end) as inF:
+                yield from iterRecords(inF, encoding, fieldNames, isTyped=isTyped, recordFilter=recordFilter,
+                    keyName=keyName, longText=longText)
+
+def doParallelConvert(inFile, inF, outF, action, encoding, opts, selectedRanges=None):
+    # convert byte ranges in a process pool, merge parts in the original record order
+    workers = opts["workers"]
+    if selectedRanges is None:
+        ranges = findRecordBoundaries(inFile, encoding, workers)
+    elif len(selectedRanges) == 1:
+        ranges = findRecordBoundaries(inFile, encoding, workers, *selectedRanges[0])
+    else:
+        ranges = []
+    if len(ranges) < 2:
+        print("single range, using serial conversion")
+        doConvert(inFile, inF, outF, action, encoding, opts, selectedRanges)
+        return()
+    tempDir = opts["tempDir"]
+    if tempDir == "":
+        tempDir = os.path.dirname(os.path.abspath(outF.name))
+    # field types are fixed before the ranges are typed in the workers
+    fieldTypes = getFieldTypes(opts)
+    if opts["typing"] == "field" and not fieldTypes:
+        sample = itertools.islice(getRecords(inFile, None, encoding, None, dict(opts, typing="none"),
+            [(ranges[0][0], ranges[-1][1])]), opts["typeSample"])
+        inferFieldTypes(sample, fieldTypes)
+        print('***', len(fieldTypes), "field types inferred from the first", opts["typeSample"], "records")
+    print("converting", len(ranges), "ranges with", workers, "workers")
+    jobs = [(inFile, encoding, start, end, action, outF.encoding, tempDir, opts, fieldTypes) for start, end in ranges]
+    with metrics.phase("ranges"), concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(convertRange, jobs))
+    recordCount = metrics.recordCount = sum(r[1] for r in results)
+    partFiles = [r[0] for r in results]
+    fieldNames = set()
+    for r in results:
+        fieldNames.update(r[2])
+    try:
+        with metrics.phase("merge"):
+            if action == "toCsv" and getDdlHeader(opts) is not None:
+                # rows written by the workers, after the header
+                getCsvWriter(outF, getDdlHeader(opts))
+                outF.flush()
+                for p in partFiles:
+                    with open(p, "rb") as partF:
+                        shutil.copyfileobj(partF, outF.buffer)
+            elif action == "toCsv":
+                spillFiles = [open(p, "rb") for p in partFiles]
+                writeCsvFromSpills(outF, spillFiles, fieldNames, encoding, opts["fieldList"])
+                for spillF in spillFiles:
+                    spillF.close()
+            elif action == "toJsonl":
+                outF.flush()
+                for p in partFiles:
+                    with open(p, "rb") as partF:
+                        shutil.copyfileobj(partF, outF.buffer)
+            else:
+                writeHeader, writeFooter = (writeJsonHeader, writeJsonFooter) if action == "toJson" \
+                    else (writeXmlHeader, writeXmlFooter)
+                writeHeader(outF)
+                outF.flush()
+                isFirst = True
+                for p, partCount, partNames in results:
+                    # json parts have no leading comma, it is written between non empty parts
+                    if partCount == 0:
+                        continue
+                    if action == "toJson" and not isFirst:
+                        outF.write(",\n")
+                        outF.flush()
+                    isFirst = False
+                    with open(p, "rb") as partF:
+                        shutil.copyfileobj(partF, outF.buffer)
+                writeFooter(outF, recordCount)
+    finally:
+        for p in partFiles:
+            os.remove(p)
+    if opts["typing"] == "field":
+        writeSchema(opts["schema"], fieldTypes, fieldNames)
+    print("{0:,} total records".format(recordCount))
+    return()
+
+########## checkpoint / resume ##########
+
+def saveCheckpoint(checkpointFile, checkpoint, outF):
+    # output is flushed to disk before the checkpoint is replaced
+    outF.flush()
+    os.fsync(outF.fileno())
+    checkpoint["outPos"] = outF.buffer.tell()
+    with open(checkpointFile + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpointFile + ".tmp", checkpointFile)
+    return()
+
+def getCheckpointSignature(opts):
+    # options changing the output, a conversion is only resumed with the same ones
+    return(json.dumps([opts["pretty"], opts["typing"], opts["fields"], opts["records"], opts["where"], opts["ddl"]]))
+
+def readCheckpoint(checkpointFile, inFile, action, encoding, opts):
+    try:
+        with open(checkpointFile, "r") as f:
+            checkpoint = json.load(f)
+    except Exception as e:
+        print("cannot read checkpoint", checkpointFile, "run without --resume")
+        print (str(e))
+        abnormalTermination()
+    if checkpoint["inFile"] != os.path.abspath(inFile) or checkpoint["inSize"] != os.path.getsize(inFile) \
+        or checkpoint["action"] != action or checkpoint["encoding"] != encoding:
+        print("checkpoint", checkpointFile, "was made by another conversion")
+        abnormalTermination()
+    if checkpoint.get("options") != getCheckpointSignature(opts):
+        print("checkpoint", checkpointFile, "was made with other --compact, --typing, --fields, --records, --where or --ddl options")
+        abnormalTermination()
+    return(checkpoint)
+
+def iterCheckpointSegments(f, ranges, inOffset, segmentSize):
+    # (start, end) segments of about segmentSize bytes cut at R lines, of the ranges after inOffset
+    for start, end in ranges:
+        start = max(start, inOffset)
+        while start < end:
+            segmentEnd = findNextRecordStart(f, start + segmentSize, end)
+            yield(start, segmentEnd)
+            start = segmentEnd
+    return
+
+def doCheckpointConvert(inFile, outFile, action, encoding, opts):
+    # convert segments of --checkpoint MB of input (or of the --from/--to/--key selected ranges)
+    # cut at R lines, after each one save the input offset, record count and output position in outFile.ckpt
+    checkpointFile = outFile + ".ckpt"
+    inSize = os.path.getsize(inFile)
+    if opts["fromRecord"] > 0 or opts["toRecord"] > 0 or opts["key"] != "":
+        ranges = sorted(getSelectedRanges(inFile, encoding, opts))
+    else:
+        ranges = [(0, inSize)]
+    segmentSize = (opts["checkpoint"] if opts["checkpoint"] > 0 else 64) * 1024 * 1024
+    if action not in ("toJson", "toJsonl", "toXml", "toCsv"):
+        print("checkpoints not possible with action", action)
+        abnormalTermination()
+    isDdl = getDdlHeader(opts) is not None
+    if action == "toCsv" and isDdl:
+        header = getDdlHeader(opts)
+    elif action == "toCsv":
+        if opts["fieldList"] == "" or not os.path.exists(opts["fieldList"]):
+            print("toCsv checkpoints need the header from an existing --fieldlist or --ddl")
+            abnormalTermination()
+        header = readFieldList(opts["fieldList"], encoding)
+    if opts["resume"]:
+        checkpoint = readCheckpoint(checkpointFile, inFile, action, encoding, opts)
+        if checkpoint.get("ranges", [[0, inSize]]) != [list(r) for r in ranges]:
+            print("checkpoint", checkpointFile, "was made with another record selection")
+            abnormalTermination()
+        # drop what was written after the checkpoint
+        with open(outFile, "r+b") as f:
+            f.truncate(checkpoint["outPos"])
+        outF = open(outFile, "a", encoding=getOutEncoding(action, encoding))
+        print("resuming at record {0:,}, input offset {1:,}".format(checkpoint["recordCount"] + 1,
+            checkpoint["inOffset"]))
+    else:
+        checkpoint = {"inFile": os.path.abspath(inFile), "inSize": inSize, "action": action,
+            "encoding": encoding, "options": getCheckpointSignature(opts), "ranges": ranges, "inOffset": 0,
+            "recordCount": 0, "fieldTypes": getFieldTypes(opts)}
+        outF = openOutFile(outFile, getOutEncoding(action, encoding))
+        if action == "toJson":
+            writeJsonHeader(outF)
+        elif action == "toXml":
+            writeXmlHeader(outF)
+        saveCheckpoint(checkpointFile, checkpoint, outF)
+    if action == "toCsv":
+        writer = getCsvWriter(outF, header, not opts["resume"])
+    inOffset, recordCount = checkpoint["inOffset"], checkpoint["recordCount"]
+    selectedSize = sum(end - start for start, end in ranges)
+    with open(inFile, "rb") as f:
+        for segmentStart, segmentEnd in iterCheckpointSegments(f, ranges, inOffset, segmentSize):
+            records = getRecords(inFile, None, encoding, None, opts, [(segmentStart, segmentEnd)], checkpoint["fieldTypes"])
+            if action == "toJson":
+                recordCount += writeJsonRecords(records, outF, recordCount == 0, trace=False)
+            elif action == "toJsonl":
+                recordCount += writeJsonlRecords(records, outF, trace=False)
+            elif action == "toXml":
+                recordCount += writeXmlRecords(records, outF, trace=False, isPretty=opts["pretty"])
+            else:
+                for recordName, fieldsDict in records:
+                    recordCount += 1
+                    writeCsvRow(writer, fieldsDict, recordCount, opts["fieldList"], isDdl)
+            inOffset = segmentEnd
+            checkpoint["inOffset"], checkpoint["recordCount"] = inOffset, recordCount
+            saveCheckpoint(checkpointFile, checkpoint, outF)
+            doneSize = sum(min(end, inOffset) - start for start, end in ranges if start < inOffset)
+            print("{0:,} records, {1:.1f}% of input, checkpoint saved".format(recordCount, 100 * doneSize / selectedSize))
+    if action == "toJson":
+        writeJsonFooter(outF, recordCount)
+    elif action == "toXml":
+        writeXmlFooter(outF, recordCount)
+    outF.close()
+    os.remove(checkpointFile)
+    if opts["typing"] == "field":
+        writeSchema(opts["schema"], checkpoint["fieldTypes"])
+    print("{0:,} total records".format(recordCount))
+    return()
+
+########## delta between dumps ##########
+
+def getFingerprint(s):
+    # 64 bits blake2b hash of bytes s
+    return(int.from_bytes(hashlib.blake2b(s, digest_size=8).digest(), "little"))
+
+def getDiffSignature(opts):
+    # options changing the records, a fingerprint index is only used with the same ones
+    return(json.dumps([opts["diffKey"], opts["typing"], opts["fields"], opts["records"], opts["where"], opts["ddl"]]))
+
+def iterFingerprints(records, diffKey):
+    # (keyHash, recordHash, record) of each record, the key hash includes the record name
+    for recordName, fieldsDict in records:
+        key = getRecordKey(fieldsDict, diffKey) or ""
+        keyHash = getFingerprint((recordName + "\0" + key).encode("UTF-8"))
+        recordHash = getFingerprint(pickle.dumps((recordName, fieldsDict), 4))
+        yield(keyHash, recordHash, (recordName, fieldsDict))
+
+def writeFingerprintIndex(fingerprintFile, dumpFile, signature, keyHashes, recordHashes):
+    '''
+    write the fingerprint index of a dump, little endian, sections 8 bytes aligned :
+    magic, recordCount, dumpSize, dumpMtime (ns), signatureSize (Q), signature,
+    keyHashes[recordCount] (Q, sorted), recordHashes[recordCount] (Q), recordNumbers[recordCount] (Q, 1 based)
+    '''
+    order = sorted(range(len(keyHashes)), key=keyHashes.__getitem__)
+    stat = os.stat(dumpFile)
+    signatureBlob = signature.encode("UTF-8")
+    with open(fingerprintFile, "wb") as f:
+        f.write(struct.pack("<8sQQQQ", fingerprintMagic, len(order), stat.st_size, stat.st_mtime_ns, len(signatureBlob)))
+        f.write(padTo8(signatureBlob))
+        f.write(array("Q", [keyHashes[i] for i in order]).tobytes())
+        f.write(array("Q", [recordHashes[i] for i in order]).tobytes())
+        f.write(array("Q", [i + 1 for i in order]).tobytes())
+    return()
+
+class FingerprintIndex:
+    # read only view of a fingerprint index, see writeFingerprintIndex
+    def __init__(self, fingerprintFile):
+        self.f = open(fingerprintFile, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, self.dumpSize, self.dumpMtime, signatureSize = struct.unpack_from("<8sQQQQ", self.mm)
+        if magic != fingerprintMagic:
+            raise ValueError(fingerprintFile + " is not a fingerprint index")
+        self.recordCount = n
+        pos = struct.calcsize("<8sQQQQ")
+        self.signature = bytes(self.mm[pos:pos + signatureSize]).decode("UTF-8")
+        pos += signatureSize + (-signatureSize % 8)
+        view = memoryview(self.mm)
+        self.keyHashes = view[pos:pos + 8 * n].cast("Q")
+        self.recordHashes = view[pos + 8 * n:pos + 16 * n].cast("Q")
+        self.recordNumbers = view[pos + 16 * n:pos + 24 * n].cast("Q")
+        # entries matched by a record of the new dump
+        self.isSeen = bytearray(n)
+
+    def isValid(self, dumpFile, signature):
+        stat = os.stat(dumpFile)
+        return(self.dumpSize == stat.st_size and self.dumpMtime == stat.st_mtime_ns and self.signature == signature)
+
+    def match(self, keyHash):
+        # first entry with this key not matched yet, None if there is none
+        i = bisect.bisect_left(self.keyHashes, keyHash)
+        while i < self.recordCount and self.keyHashes[i] == keyHash:
+            if not self.isSeen[i]:
+                self.isSeen[i] = 1
+                return(i)
+            i += 1
+        return(None)
+
+    def close(self):
+        self.keyHashes.release()
+        self.recordHashes.release()
+        self.recordNumbers.release()
+        self.mm.close()
+        self.f.close()
+
+def stopDiffKeyMissing(dumpFile, diffKey):
+    # without any key the records would be matched by their position, one insert shifts all the others
+    print("no record of", dumpFile, "has a", "K line key" if diffKey == "K" else "field " + diffKey)
+    print("pass --diffkey=FIELD, a field identifying the records")
+    abnormalTermination()
+    return()
+
+def getOldRecords(oldFile, encoding, opts):
+    # records of the old dump through the pipeline of the new ones (filter, --ddl lists and types)
+    return(getRecords(oldFile, oldFile, encoding, None, opts, None, getFieldTypes(opts), None))
+
+def getFingerprintIndex(oldFile, encoding, opts):
+    # fingerprint index of the old dump, oldFile.fpx is built by a pass over it if missing or outdated
+    fingerprintFile = oldFile + ".fpx"
+    signature = getDiffSignature(opts)
+    if os.path.exists(fingerprintFile):
+        index = FingerprintIndex(fingerprintFile)
+        if index.isValid(oldFile, signature):
+            print("*** {0:,} fingerprints read from {1}".format(index.recordCount, fingerprintFile))
+            return(index)
+        index.close()
+    keyHashes, recordHashes = array("Q"), array("Q")
+    keyCount = 0
+    for keyHash, recordHash, (recordName, fieldsDict) in iterFingerprints(getOldRecords(oldFile, encoding, opts),
+        opts["diffKey"]):
+        keyHashes.append(keyHash)
+        recordHashes.append(recordHash)
+        if getRecordKey(fieldsDict, opts["diffKey"]):
+            keyCount += 1
+    if keyCount == 0 and len(keyHashes) > 0:
+        stopDiffKeyMissing(oldFile, opts["diffKey"])
+    writeFingerprintIndex(fingerprintFile, oldFile, signature, keyHashes, recordHashes)
+    print("*** {0:,} fingerprints written to {1}".format(len(keyHashes), fingerprintFile))
+    return(FingerprintIndex(fingerprintFile))
+
+def diffRecords(records, inFile, encoding, fieldNames, opts):
+    '''
+    --diff=old.dmp : records of the new dump inserted (key not in the old dump) or updated
+    (other fingerprint), then the records of the old dump deleted, with their change in field
+    changeFieldName, records are matched by record name and K key or --diffkey field,
+    inFile.fpx is written for the next delta
+    '''
+    oldFile = opts["diff"]
+    index = getFingerprintIndex(oldFile, encoding, opts)
+    if fieldNames is not None:
+        fieldNames.add(changeFieldName)
+        if opts["keyName"] != "":
+            fieldNames.add(opts["keyName"])
+    counts = {"insert": 0, "update": 0, "delete": 0, "unchanged": 0}
+    keyHashes, recordHashes = array("Q"), array("Q")
+    keyCount = 0
+    for keyHash, recordHash, (recordName, fieldsDict) in iterFingerprints(records, opts["diffKey"]):
+        keyHashes.append(keyHash)
+        recordHashes.append(recordHash)
+        if getRecordKey(fieldsDict, opts["diffKey"]):
+            keyCount += 1
+        i = index.match(keyHash)
+        if i is None:
+            change = "insert"
+        elif index.recordHashes[i] != recordHash:
+            change = "update"
+        else:
+            counts["unchanged"] += 1
+            continue
+        counts[change] += 1
+        fieldsDict[changeFieldName] = change
+        yield(recordName, fieldsDict)
+    deleted = {index.recordNumbers[i] for i in range(index.recordCount) if not index.isSeen[i]}
+    index.close()
+    if deleted:
+        # deleted records, from a second pass over the old dump
+        oldRecords = getOldRecords(oldFile, encoding, opts)
+        for recordNumber, (recordName, fieldsDict) in enumerate(oldRecords, 1):
+            if recordNumber in deleted:
+                counts["delete"] += 1
+                fieldsDict[changeFieldName] = "delete"
+                if fieldNames is not None:
+                    fieldNames.update(fieldsDict)
+                yield(recordName, fieldsDict)
+    print("*** {insert:,} inserted, {update:,} updated, {delete:,} deleted, {unchanged:,} unchanged records".format(**counts))
+    if keyCount == 0 and len(keyHashes) > 0:
+        stopDiffKeyMissing(inFile, opts["diffKey"])
+    writeFingerprintIndex(inFile + ".fpx", inFile, getDiffSignature(opts), keyHashes, recordHashes)
+    return
+
+########## record index ##########
+
+def buildRecordIndex(inFile, encoding, indexFile):
+    '''
+    write the record offset index sidecar, little endian, sections 8 bytes aligned :
+    magic, recordCount, namesSize, keysSize, dumpSize (Q)
+    record names (\\n separated), offsets[recordCount] (Q), keyStarts[recordCount+1] (Q),
+    keyOrder[recordCount] (Q, record indices sorted by key), nameIds[recordCount] (H), keys
+    '''
+    offsets, keyStarts, nameIds = array("Q"), array("Q"), array("H")
+    keys = bytearray()
+    names = {}
+    with open(inFile, "rb") as f:
+        dumpSize = os.fstat(f.fileno()).st_size
+        if dumpSize > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasKey = True
+                for m in indexLineRe.finditer(mm):
+                    line = m.group()
+                    # R  EMPLOYEE                            <<< record # 1 >>>
+                    if line[:1] == b"R":
+                        keyStarts.append(len(keys))
+                        offsets.append(m.start())
+                        recordName = getRecordName(line.decode(encoding).rstrip())
+                        nameIds.append(names.setdefault(recordName, len(names)))
+                        if len(offsets) % (traceEvery * 10) == 0:
+                            metrics.progress(len(offsets))
+                        hasKey = False
+                    # K  keyValue, first one of the record
+                    elif not hasKey:
+                        keys += line[3:].strip()
+                        hasKey = True
+    keyStarts.append(len(keys))
+    recordCount = len(offsets)
+    keyOrder = array("Q", sorted(range(recordCount), key=lambda i: keys[keyStarts[i]:keyStarts[i + 1]]))
+    namesBlob = "\n".join(names.keys()).encode("UTF-8")
+    with open(indexFile, "wb") as f:
+        f.write(struct.pack("<8sQQQQ", indexMagic, recordCount, len(namesBlob), len(keys), dumpSize))
+        f.write(padTo8(namesBlob))
+        f.write(offsets.tobytes())
+        f.write(keyStarts.tobytes())
+        f.write(keyOrder.tobytes())
+        f.write(padTo8(nameIds.tobytes()))
+        f.write(keys)
+    print("*** {0:,} records, {1:,} record names, index written to {2}".format(recordCount, len(names), indexFile))
+    return()
+
+def padTo8(b):
+    return(bytes(b) + b"\0" * (-len(b) % 8))
+
+class RecordIndex:
+    # read only view of a record index sidecar, see buildRecordIndex
+    def __init__(self, indexFile):
+        self.f = open(indexFile, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, namesSize, keysSize, self.dumpSize = struct.unpack_from("<8sQQQQ", self.mm)
+        if magic != indexMagic:
+            raise ValueError(indexFile + " is not a record index")
+        self.recordCount = n
+        pos = struct.calcsize("<8sQQQQ")
+        self.names = bytes(self.mm[pos:pos + namesSize]).decode("UTF-8").split("\n")
+        pos += namesSize + (-namesSize % 8)
+        view = memoryview(self.mm)
+        self.offsets = view[pos:pos + 8 * n].cast("Q")
+        pos += 8 * n
+        self.keyStarts = view[pos:pos + 8 * (n + 1)].cast("Q")
+        pos += 8 * (n + 1)
+        self.keyOrder = view[pos:pos + 8 * n].cast("Q")
+        pos += 8 * n
+        self.nameIds = view[pos:pos + 2 * n].cast("H")
+        pos += 2 * n + (-2 * n % 8)
+        self.keysPos = pos
+
+    def getName(self, i):
+        # record i, 0 based
+        return self.names[self.nameIds[i]]
+
+    def getKey(self, i):
+        return bytes(self.mm[self.keysPos + self.keyStarts[i]:self.keysPos + self.keyStarts[i + 1]])
+
+    def getRange(self, first, last):
+        # [start, end[ bytes of records first..last, 1 based, inclusive
+        first, last = max(first, 1), min(last, self.recordCount)
+        if first > last:
+            return None
+        end = self.offsets[last] if last < self.recordCount else self.dumpSize
+        return (self.offsets[first - 1], end)
+
+    def findKey(self, key):
+        # 1 based numbers of the records with this key, in dump order
+        sortedKeys = KeyOrderView(self)
+        i = bisect.bisect_left(sortedKeys, key)
+        found = []
+        while i < self.recordCount and sortedKeys[i] == key:
+            found.append(self.keyOrder[i] + 1)
+            i += 1
+        return sorted(found)
+
+    def close(self):
+        self.offsets.release()
+        self.keyStarts.release()
+        self.keyOrder.release()
+        self.nameIds.release()
+        self.mm.close()
+        self.f.close()
+
+class KeyOrderView:
+    # keys in sorted order, as a sequence for bisect
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.recordCount
+
+    def __getitem__(self, i):
+        return self.index.getKey(self.index.keyOrder[i])
+
+def getSelectedRanges(inFile, encoding, opts):
+    # byte ranges of the records selected with --from/--to or --key
+    indexFile = opts["index"] if opts["index"] != "" else inFile + ".idx"
+    try:
+        index = RecordIndex(indexFile)
+    except Exception as e:
+        print("cannot read record index", indexFile, "build it with -a index")
+        print (str(e))
+        abnormalTermination()
+    if index.dumpSize != os.path.getsize(inFile):
+        print("record index", indexFile, "does not match", inFile, "rebuild it with -a index")
+        abnormalTermination()
+    ranges = []
+    if opts["key"] != "":
+        for i in index.findKey(opts["key"].encode(encoding)):
+            if opts["fromRecord"] <= i and (opts["toRecord"] == 0 or i <= opts["toRecord"]):
+                ranges.append(index.getRange(i, i))
+    else:
+        toRecord = opts["toRecord"] if opts["toRecord"] > 0 else index.recordCount
+        r = index.getRange(opts["fromRecord"], toRecord)
+        if r is not None:
+            ranges.append(r)
+    print("*** {0:,} byte ranges selected from {1:,} indexed records".format(len(ranges), index.recordCount))
+    index.close()
+    return(ranges)
+
+def doConvert(inFile, inF, outF, action, encoding, opts, selectedRanges=None, outFile=""):
+    # serial conversion of the whole input file or of the selected byte ranges
+    fieldNames = set()
+    fieldTypes = getFieldTypes(opts)
+    records = getRecords(inFile, inF, encoding, fieldNames, opts, selectedRanges, fieldTypes)
+    if opts["diff"] != "":
+        records = diffRecords(records, inFile, encoding, fieldNames, opts)
+    if opts["byRecord"]:
+        doHvuByRecord(records, outFile, action, encoding, opts)
+    elif opts["shardRecords"] > 0 or opts["shardBytes"] > 0:
+        doHvuToShards(records, outFile, action, encoding, fieldNames, opts)
+    elif action == "toJson":
+        doHvuToJson(records, outF)
+    elif action == "toJsonl":
+        doHvuToJsonl(records, outF)
+    elif action == "toXml":
+        doHvuToXml(records, outF, opts["pretty"])
+    elif action == "toCsv":
+        doHvuToCsv(records, outF, fieldNames, encoding, opts["fieldList"], opts["tempDir"], getDdlHeader(opts))
+    elif action in ("toParquet", "toArrow"):
+        doHvuToArrow(records, outF, action, opts["tempDir"], opts["rowGroup"], getDdlArrowSchema(opts))
+    elif action == "toSqlite":
+        doHvuToSqlite(records, outFile, opts["tempDir"])
+    elif action == "toPgCopy":
+        doHvuToPgCopy(records, outFile, opts["tempDir"])
+    elif action == "toBulk":
+        doHvuToBulk(records, outFile, opts)
+    else:
+        print("invalid action", action)
+        abnormalTermination()
+    if opts["typing"] == "field":
+        writeSchema(opts["schema"], fieldTypes, fieldNames)
     return()
 
 def getDateTimeNow():
@@ -383,6 +3354,7 @@ def getDateTimeNow():
     return(now.strftime("%d.%m.%Y %H:%M:%S"))
 
 def normalTermination():
+    metrics.finish()
     print("*** normal termination", getDateTimeNow())
     exit(0)
 
@@ -390,12 +3362,120 @@ def abnormalTermination():
     print("*** abnormal termination", getDateTimeNow())
     exit(1)
 
+########## batch mode ##########
+
+def isBatchInput(inFile):
+    # a directory, or a glob pattern which is not a file name
+    return(os.path.isdir(inFile) or (not os.path.exists(inFile) and re.search(r"[*?[]", inFile) is not None))
+
+def getBatchFiles(inFile):
+    # dumps of the directory (*.dmp, *.dmp.gz, *.dmp.zst) or of the glob pattern, largest first
+    if os.path.isdir(inFile):
+        files = [os.path.join(inFile, f) for f in os.listdir(inFile) if batchFileRe.search(f)]
+    else:
+        files = glob.glob(inFile, recursive=True)
+    files = [f for f in files if os.path.isfile(f)]
+    return(sorted(files, key=lambda f: (-os.path.getsize(f), f)))
+
+def getBatchArguments(argumentList):
+    # execution arguments given to the conversion of each dump, without input, output and batch options
+    arguments = []
+    isValue = False
+    for a in argumentList:
+        if isValue:
+            isValue = False
+        elif a in ("-i", "-o", "--in", "--out", "--metrics", "--jobs"):
+            isValue = True
+        elif not (a.startswith(("--in=", "--out=", "--metrics=", "--jobs=")) or a[:2] in ("-i", "-o")):
+            arguments.append(a)
+    return(arguments)
+
+def getBatchOutFile(outDir, inFile, action, opts, names):
+    # outDir/name.ext of a dump, names already given are numbered, "" for stats
+    name = re.sub(r"(\.dmp)?(\.gz|\.zst)?$", "", os.path.basename(inFile), flags=re.IGNORECASE)
+    names[name] = names.get(name, 0) + 1
+    if names[name] > 1:
+        name += "_%d" % names[name]
+    if action not in batchExtensions:
+        return(os.path.join(outDir, name), "")
+    outFile = os.path.join(outDir, name + batchExtensions[action])
+    if opts["compress"] in ("gz", "zst"):
+        outFile += "." + opts["compress"]
+    return(os.path.join(outDir, name), outFile)
+
+def convertBatchFile(job):
+    # convert one dump in a child process, output to its log file, return its summary
+    inFile, outFile, logFile, metricsFile, arguments = job
+    command = [sys.executable, os.path.abspath(__file__), "-i", inFile, "--metrics=" + metricsFile] + arguments
+    if outFile != "":
+        command += ["-o", outFile]
+    result = {"inFile": inFile, "outFile": outFile, "log": logFile, "bytes": os.path.getsize(inFile)}
+    start = time.perf_counter()
+    with open(logFile, "w") as logF:
+        returnCode = subprocess.run(command, stdout=logF, stderr=subprocess.STDOUT).returncode
+    result.update({"status": "ok" if returnCode == 0 else "failed", "returnCode": returnCode,
+        "seconds": round(time.perf_counter() - start, 3), "records": 0})
+    if os.path.exists(metricsFile):
+        with open(metricsFile, "r") as f:
+            result["records"] = json.load(f).get("records", 0)
+        os.remove(metricsFile)
+    if returnCode != 0:
+        # the last line before the termination message
+        with open(logFile, "r", errors="replace") as f:
+            lines = [line.strip() for line in f if line.strip() != "" and not line.startswith("*** ")]
+        result["error"] = lines[-1] if lines else ""
+    return(result)
+
+def doBatchConvert(inFile, outDir, action, opts):
+    '''
+    -i directory or glob : each dump is converted by a child process, --jobs=N at once,
+    the largest first, to outDir/name.ext with its log outDir/name.log, a failed dump
+    does not stop the others, summary printed and written to outDir/hvuBatch.json
+    '''
+    files = getBatchFiles(inFile)
+    if not files:
+        print("no dump found in", inFile)
+        abnormalTermination()
+    os.makedirs(outDir, exist_ok=True)
+    jobCount = opts["jobs"] if opts["jobs"] > 0 else max(1, (os.cpu_count() or 1) // max(1, opts["workers"]))
+    arguments = getBatchArguments(sys.argv[1:])
+    names = {}
+    jobs = []
+    for f in files:
+        base, outFile = getBatchOutFile(outDir, f, action, opts, names)
+        jobs.append((f, outFile, base + ".log", base + ".metrics.json", arguments))
+    totalBytes = sum(os.path.getsize(f) for f in files)
+    print("*** {0:,} dumps, {1:,} bytes, {2} jobs".format(len(files), totalBytes, jobCount))
+    start = time.perf_counter()
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobCount) as executor:
+        for future in concurrent.futures.as_completed([executor.submit(convertBatchFile, job) for job in jobs]):
+            result = future.result()
+            results.append(result)
+            print("{0:<7} {1} {2:,} records {3:.2f}s{4}".format(result["status"], result["inFile"], result["records"],
+                result["seconds"], "  " + result["error"] if "error" in result else ""))
+    seconds = time.perf_counter() - start
+    failed = [r for r in results if r["status"] != "ok"]
+    summary = {"inFile": inFile, "action": action, "jobs": jobCount, "dumps": len(files), "failed": len(failed),
+        "bytes": totalBytes, "records": sum(r["records"] for r in results), "seconds": round(seconds, 3),
+        "megaBytesPerSecond": round(totalBytes / 1024 / 1024 / seconds, 3) if seconds > 0 else 0,
+        "files": sorted(results, key=lambda r: files.index(r["inFile"]))}
+    summaryFile = os.path.join(outDir, "hvuBatch.json")
+    with open(summaryFile, "w") as f:
+        json.dump(summary, f, indent=2)
+    print("*** {0:,} dumps converted, {1:,} failed, {2:,} records, {3:.2f}s, {4:.1f} MB/s".format(len(files) - len(failed),
+        len(failed), summary["records"], seconds, summary["megaBytesPerSecond"]))
+    print("*** batch summary written to", summaryFile)
+    if failed:
+        abnormalTermination()
+    return()
+
 ########## main ##########
 
 def doMain():
     print("*** started", getDateTimeNow())
 
-    inFile, outFile, action, encoding = getArguments()
+    inFile, outFile, action, encoding, opts = getArguments()
 
     #print("in:", inFile, "out:", outFile, "action:", action, "encoding:", encoding)
 
@@ -404,27 +3484,141 @@ def doMain():
         printUsage()
         exit(2)
 
-    if (action != "stats" and action != "cstats") and outFile == "" :
+    if isBatchInput(inFile):
+        if outFile == "":
+            print("missing output directory")
+            printUsage()
+            exit(2)
+        doBatchConvert(inFile, outFile, action, opts)
+        normalTermination()
+
+    if encoding.lower() == "auto":
+        encoding = sniffEncoding(inFile)
+
+    metrics.outFile = opts["metrics"]
+    metrics.info.update({"action": action, "encoding": encoding, "engine": opts["engine"],
+        "workers": opts["workers"], "typing": opts["typing"]})
+    if opts["metrics"] != "" or opts["cprofile"] != "":
+        # sampling profilers (py-spy...) can attach to this pid
+        print("*** pid", os.getpid())
+    if opts["cprofile"] != "":
+        metrics.startProfiler(opts["cprofile"])
+
+    if action not in ("stats", "cstats", "profile", "index") and outFile == "" :
         print("missing output file")
         printUsage()
         exit(2)
 
+    # byte offsets of compressed input cannot be used
+    if getInCompression(inFile) != "":
+        if action == "index" or opts["checkpoint"] > 0 or opts["resume"] or opts["sample"] > 0 \
+            or opts["fromRecord"] > 0 or opts["toRecord"] > 0 or opts["key"] != "":
+            print("index, record selection, checkpoints and sampling not possible with compressed input")
+            abnormalTermination()
+        if opts["workers"] > 1:
+            print("compressed input, using serial conversion")
+            opts["workers"] = 1
+    if getOutCompression(outFile, opts) != "" and (opts["checkpoint"] > 0 or opts["resume"]):
+        print("checkpoints not possible with compressed output")
+        abnormalTermination()
+    if getOutCompression(outFile, opts) != "" and action in ("toSqlite", "toPgCopy"):
+        # a database file and the copy files loaded by psql are written as is
+        print("compressed output not possible with", action)
+        abnormalTermination()
+
+    if action == "toBulk" and opts["bulkUrl"] != "":
+        checkBulkUrl(opts["bulkUrl"])
+    if (action == "toBulk" and opts["bulkId"] == "K") or (opts["diff"] != "" and opts["diffKey"] == "K"):
+        # the parser keeps the K line key for the document id / the delta
+        opts["keyName"] = keyFieldName
+    if opts["textDir"] != "":
+        # --diff fingerprints would hash the file: references of the side files, not the texts,
+        # side files are numbered by record in the converted range, not in the whole dump
+        if opts["checkpoint"] > 0 or opts["resume"] or opts["diff"] != "" or opts["fromRecord"] > 0 \
+            or opts["toRecord"] > 0 or opts["key"] != "":
+            print("--textdir not possible with checkpoints, --diff and --from / --to / --key selections")
+            abnormalTermination()
+        # side files are named by record number in the dump
+        opts["workers"] = 1
+        os.makedirs(opts["textDir"], exist_ok=True)
+    if opts["byRecord"]:
+        if action not in ("toJson", "toJsonl", "toXml", "toCsv", "toParquet", "toArrow") or opts["checkpoint"] > 0 \
+            or opts["resume"] or opts["shardRecords"] > 0 or opts["shardBytes"] > 0:
+            print("--byrecord is for toJson, toJsonl, toXml, toCsv, toParquet and toArrow, without checkpoints and shards")
+            abnormalTermination()
+        opts["workers"] = 1
+    if opts["shardRecords"] > 0 or opts["shardBytes"] > 0:
+        if action not in ("toJson", "toJsonl", "toXml", "toCsv") or opts["checkpoint"] > 0 or opts["resume"]:
+            print("shards are written by toJson, toJsonl, toXml and toCsv, without checkpoints")
+            abnormalTermination()
+        opts["workers"] = 1
+    if opts["diff"] != "":
+        if opts["checkpoint"] > 0 or opts["resume"] or opts["fromRecord"] > 0 or opts["toRecord"] > 0 \
+            or opts["key"] != "" or opts["typing"] == "field" or action not in batchExtensions or action == "profile":
+            print("--diff converts whole dumps, without record selection, checkpoints, --typing=field, stats and profile")
+            abnormalTermination()
+        if action == "toBulk" and opts["bulk"] == "solr":
+            # the /update/json/docs handler only adds documents, deletes need the /update commands
+            print("--diff not possible with --bulk=solr, deleted records cannot be sent as documents")
+            abnormalTermination()
+        opts["workers"] = 1
+    if opts["ddl"] != "" and action not in ("stats", "cstats", "profile", "index"):
+        # fixed columns and types, the records are neither pre-scanned nor sampled
+        opts["ddlSchema"] = readDdlSchema(opts["ddl"], opts)
+        if opts["typing"] == "value":
+            opts["typing"] = "field"
+        metrics.info["typing"] = opts["typing"]
+
+    if action in ("stats", "cstats") and opts["sample"] == 0 \
+        and (opts["fields"] != "" or opts["records"] != "" or opts["where"]):
+        # stats counts the dump lines, records are not parsed
+        print("--fields, --records and --where are not applied by stats / cstats, use -a profile or --sample")
+        abnormalTermination()
+
+    if action == "index":
+        buildRecordIndex(inFile, encoding, opts["index"] if opts["index"] != "" else inFile + ".idx")
+        normalTermination()
+
+    if opts["checkpoint"] > 0 or opts["resume"]:
+        doCheckpointConvert(inFile, outFile, action, encoding, opts)
+        normalTermination()
+
+    if opts["sample"] > 0 and action in ("stats", "cstats", "profile"):
+        doSample(inFile, encoding, opts, outFile)
+        normalTermination()
+
+    selectedRanges = None
+    if opts["fromRecord"] > 0 or opts["toRecord"] > 0 or opts["key"] != "":
+        selectedRanges = getSelectedRanges(inFile, encoding, opts)
+
     inF = openInFile(inFile, encoding)
+    metrics.setInput(inFile, inF, selectedRanges is None)
 
     if action == "stats" or action == "cstats":
-        doStats(inF, action, encoding)
-    else:
-        outF = openOutFile(outFile, encoding)
-        if action == "toJson":
-            doHvuToJson(inF, outF)
-        elif action == "toXml":
-            doHvuToXml(inF, outF)
-        elif action == "toCsv":
-            doHvuToCsv(inF, outF, encoding)
+        if selectedRanges is None:
+            doStats(inF, action, encoding)
         else:
-            print("invalid action", action)
-            abnormalTermination()
-        outF.close()
+            doStats(itertools.chain.from_iterable(openRangeFile(inFile, encoding, start, end)
+                for start, end in selectedRanges), action, encoding)
+    elif action == "profile":
+        doProfile(getRecords(inFile, inF, encoding, None, dict(opts, typing="none"), selectedRanges), outFile,
+            getOutCompression(outFile, opts))
+    elif action in ("toSqlite", "toPgCopy", "toBulk") or opts["shardRecords"] > 0 or opts["shardBytes"] > 0 \
+        or opts["byRecord"]:
+        # database file / output directory / numbered files, written by the action itself
+        with metrics.phase("convert"):
+            doConvert(inFile, inF, None, action, encoding, opts, selectedRanges, outFile)
+    else:
+        outF = openOutFile(outFile, getOutEncoding(action, encoding), action in ("toParquet", "toArrow"),
+            getOutCompression(outFile, opts))
+        if action not in ("toParquet", "toArrow"):
+            outF = TimedWriter(outF)
+        with metrics.phase("convert"):
+            if opts["workers"] > 1 and action in ("toJson", "toJsonl", "toXml", "toCsv"):
+                doParallelConvert(inFile, inF, outF, action, encoding, opts, selectedRanges)
+            else:
+                doConvert(inFile, inF, outF, action, encoding, opts, selectedRanges)
+            outF.close()
     inF.close()
     normalTermination()
 
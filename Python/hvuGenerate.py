@@ -0,0 +1,159 @@
+#! /opt/local/bin/python
+
+''' hvuGenerate : write a synthetic LCS hvu stream formated file (DMHVU Stream format)
+usage : python hvuGenerate.py -o file.dmp {--records=N | --size=MB} {--fields=N} {--seed=N}
+records of a few record types, with R, K, C, V, E/L/D lines, multi occurrence fields
+and text broken by a stray CR, as exported by DMHVU
+created : marcel.bechtiger@domain-sa.ch - 20261018
+modified :
+'''
+
+import getopt, sys, random
+from datetime import datetime
+
+# record types written in turn at random
+recordNames = ["EMPLOYEE", "DEPARTMENT", "PROJECT"]
+# words of the text values, some with latin-1 characters
+words = ["La", "monnaie", "et", "le", "crédit", "année", "dépôt", "Zürich", "Genève", "contrat",
+    "numéro", "délai", "façade", "<note>", "A&B", "\"quoted\"", "'single'", "#", "data", "value"]
+# characters of a L line
+lineLength = 70
+# generator options, see printUsage
+defaultOptions = {"records": 1000, "size": 0, "fields": 20, "multi": 0.2, "long": 0.1, "comment": 0.1,
+    "broken": 0.02, "seed": 1}
+
+def printUsage():
+    print("usage : hvuGenerate.py --out=file.dmp {--records=N} {--size=MB} {--fields=20} {--multi=0.2}")
+    print("            {--long=0.1} {--comment=0.1} {--broken=0.02} {--seed=1} {--encoding=ISO-8859-1}")
+    print("or      hvuGenerate.py -o file.dmp ...")
+    print("          --records=N records to write (default 1000), or --size=MB to write about MB megabytes")
+    print("          --fields=N fields per record type, --multi ratio of multi occurrence fields,")
+    print("          --long ratio of E/L/D long text fields, --comment ratio of records with a C line,")
+    print("          --broken ratio of long texts with a CR-broken continuation line")
+
+def getArguments():
+    # get execution arguments
+    argumentList = sys.argv[1:]
+    options = "ho:e:"
+    longOptions = ["help", "out=", "encoding=", "records=", "size=", "fields=", "multi=", "long=",
+        "comment=", "broken=", "seed="]
+    outFile = ""
+    encoding = "ISO-8859-1"
+    opts = dict(defaultOptions)
+    try:
+        arguments, values = getopt.getopt(argumentList, options, longOptions)
+        for a, v in arguments:
+            if a in ("-h", "--help"):
+                printUsage()
+            elif a in ("-o", "--out"):
+                outFile = v
+            elif a in ("-e", "--encoding"):
+                encoding = v
+            elif a in ("--records", "--fields", "--seed"):
+                opts[a[2:]] = int(v)
+            elif a in ("--size", "--multi", "--long", "--comment", "--broken"):
+                opts[a[2:]] = float(v)
+            else:
+                printUsage()
+    except (getopt.error, ValueError) as err:
+        print (str(err))
+        exit(1)
+    return(outFile, encoding, opts)
+
+def getFieldModels(rng, opts):
+    # per record type : list of (fieldName, kind, isMulti, presence) sorted by name as DMHVU does
+    models = {}
+    kinds = ["int", "decimal", "code", "date", "text", "text"]
+    for recordName in recordNames:
+        fields = []
+        for i in range(opts["fields"]):
+            if rng.random() < opts["long"]:
+                kind = "long"
+            else:
+                kind = rng.choice(kinds)
+            fields.append(("%s_F%02d" % (recordName[:3], i + 1), kind, rng.random() < opts["multi"],
+                rng.choice([1.0, 1.0, 0.9, 0.5, 0.1])))
+        models[recordName] = sorted(fields)
+    return(models)
+
+def getValue(rng, kind, recordNumber):
+    if kind == "int":
+        return(str(rng.randint(-1000, 10 ** rng.randint(1, 9))))
+    if kind == "decimal":
+        return("%.2f" % (rng.random() * 10 ** rng.randint(1, 6)))
+    if kind == "code":
+        return("%06d" % (recordNumber % 1000000))
+    if kind == "date":
+        return("%04d%02d%02d" % (rng.randint(1950, 2030), rng.randint(1, 12), rng.randint(1, 28)))
+    return(" ".join(rng.choice(words) for i in range(rng.randint(1, 6))))
+
+def getLongText(rng, opts, lines):
+    # E block : text cut in L (full) and D (last, shorter) lines, sometimes broken by a CR
+    text = " ".join(rng.choice(words) for i in range(rng.randint(5, 120)))
+    for pos in range(0, len(text), lineLength):
+        part = text[pos:pos + lineLength]
+        if len(part) == lineLength:
+            lines.append("L%02d%s" % (lineLength, part))
+        else:
+            lines.append("D  " + part)
+    if rng.random() < opts["broken"]:
+        lines.append("D  broken by a carriage return\r" + text[:20])
+    return()
+
+def getRecordLines(rng, models, opts, recordNumber):
+    recordName = rng.choice(recordNames)
+    lines = ["R  %-35s <<< record # %d >>>" % (recordName, recordNumber)]
+    if rng.random() < opts["comment"]:
+        lines.append("C  generated record %d" % recordNumber)
+    lines.append("K  %s%09d" % (recordName[:3], recordNumber))
+    for fieldName, kind, isMulti, presence in models[recordName]:
+        if rng.random() >= presence:
+            continue
+        occurrences = rng.randint(1, 5) if isMulti else 1
+        for occ in range(1, occurrences + 1):
+            if kind == "long":
+                lines.append("E  %s(%d)" % (fieldName, occ))
+                getLongText(rng, opts, lines)
+            else:
+                lines.append("V  %s(%d)=%s" % (fieldName, occ, getValue(rng, kind, recordNumber)))
+    return(lines)
+
+def generateDump(outFile, encoding="ISO-8859-1", opts=None):
+    '''
+    write the synthetic dump, opts overrides defaultOptions (records, or size in MB if > 0),
+    return (recordCount, bytesCount)
+    '''
+    opts = dict(defaultOptions, **(opts or {}))
+    rng = random.Random(opts["seed"])
+    models = getFieldModels(rng, opts)
+    maxBytes = int(opts["size"] * 1024 * 1024)
+    recordCount = bytesCount = 0
+    with open(outFile, "w", encoding=encoding, newline="", buffering=1024 * 1024) as outF:
+        while (maxBytes > 0 and bytesCount < maxBytes) or (maxBytes == 0 and recordCount < opts["records"]):
+            recordCount += 1
+            block = "\n".join(getRecordLines(rng, models, opts, recordCount)) + "\n"
+            outF.write(block)
+            bytesCount += len(block.encode(encoding)) if not block.isascii() else len(block)
+            if recordCount % 100000 == 0:
+                print("{0:,} records".format(recordCount))
+    return(recordCount, bytesCount)
+
+def getDateTimeNow():
+    now = datetime.now()
+    return(now.strftime("%d.%m.%Y %H:%M:%S"))
+
+########## main ##########
+
+def doMain():
+    print("*** started", getDateTimeNow())
+    outFile, encoding, opts = getArguments()
+    if outFile == "":
+        print("missing output file")
+        printUsage()
+        exit(2)
+    recordCount, bytesCount = generateDump(outFile, encoding, opts)
+    print("*** {0:,} records, {1:,} bytes written to {2}".format(recordCount, bytesCount, outFile))
+    print("*** normal termination", getDateTimeNow())
+
+if __name__ == "__main__":
+    doMain()